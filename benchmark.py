@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+
+# benchmarks of the trajectory classes
+#
+# writes synthetic trajectory files in the simulator format (the header of
+# trajectory_io.columns, 0.1 s steps) and times every stage of processing
+# them separately: importing trajectory_classes (in a new interpreter),
+# scanning the directory, parsing, renaming/scaling, loading from the
+# binary cache, and drawing and saving every plot kind.
+# the times can be stored as a baseline; later runs are compared against
+# it and a stage slower than its baseline by more than the threshold (and
+# by more than min_delta seconds, below which the differences are noise)
+# is a regression (exit status 1), as is an import slower than the import
+# budget or one that loads the plotting libraries, e.g.
+#
+#   ./benchmark.py --rows 15000 --files 4 --save-baseline
+#   ./benchmark.py --rows 15000 --files 4
+
+import matplotlib as mpl
+mpl.use('Agg')
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+import trajectory_io
+import trajectory_classes as tc
+
+
+# synthetic trajectories
+#
+# a boost, a skipping glide and a final dive over a spherical earth; the
+# values are plausible rather than physical, only their format and size
+# matter here
+
+earth_radius = 6371.0     # km
+
+
+def synthetic_trajectory(rows, seed = 0):
+
+    rng = np.random.default_rng(seed)
+
+    t = np.arange(rows) * 0.1
+    s = t / max(t[-1], 1.0)               # flight fraction
+
+    # altitude (km): climb to apogee, damped skips, dive
+
+    apogee = 80.0 * (1 + 0.05 * rng.standard_normal())
+    skips = 4 + rng.integers(0, 3)
+
+    alt = apogee * np.sin(np.pi * np.clip(s / 0.25, 0, 1) / 2)
+    glide = 40.0 + ((apogee - 40.0) * np.exp(-3 * (s - 0.25))
+                    * np.cos(2 * np.pi * skips * (s - 0.25) / 0.65))
+    alt = np.where(s < 0.25, alt, glide)
+    alt = np.where(s < 0.9, alt, glide * (1 - (s - 0.9) / 0.1)**2)
+    alt[0] = 1e-3
+
+    # ground track: range along a great circle at a constant heading,
+    # plus a slow crossrange drift
+
+    ground = 4000.0 * (1 + 0.1 * rng.standard_normal()) * s**1.2
+    heading = 170.0 + 10.0 * rng.standard_normal()
+    cross = 5.0 * rng.standard_normal() * s**2 * 100
+
+    az = np.radians(heading)
+    angle = ground / earth_radius
+    lat0 = np.radians(30.0)
+    lon0 = np.radians(-150.0)
+
+    lat = np.arcsin(np.sin(lat0) * np.cos(angle)
+                    + np.cos(lat0) * np.sin(angle) * np.cos(az))
+    lon = lon0 + np.arctan2(np.sin(az) * np.sin(angle) * np.cos(lat0),
+                            np.cos(angle) - np.sin(lat0) * np.sin(lat))
+
+    r = (earth_radius + alt) * 1e3
+    x = r * np.cos(lat) * np.cos(lon)
+    y = r * np.cos(lat) * np.sin(lon)
+    z = r * np.sin(lat)
+
+    # speed, accelerations and angles from the path
+
+    dt = 0.1
+    v = np.hypot(np.gradient(ground, dt), np.gradient(alt, dt)) * 1e3
+    v[0] = 0.1
+    a = np.abs(np.gradient(v, dt)) + 9.80665
+    ax = a * np.cos(np.radians(30.0 * s))
+    az_b = 1e-3 * rng.standard_normal(rows)
+    pitch = np.degrees(np.arctan2(np.gradient(alt, dt),
+                                  np.gradient(ground, dt) + 1e-9))
+    pitch[0] = 89.99
+
+    return np.column_stack([
+        t, x, y, z, ground, alt, ground * 1e3, cross * 1e3, v, a, ax,
+        np.zeros(rows), az_b, pitch, np.full(rows, heading) % 360,
+        v / 295.0])
+
+
+# write a synthetic trajectory file with the simulator header
+
+def write_trajectory(path, rows, seed = 0):
+
+    with open(path, 'w') as fh:
+        fh.write(','.join(trajectory_io.columns) + '\n')
+        np.savetxt(fh, synthetic_trajectory(rows, seed), fmt = '%.6G',
+                   delimiter = ',')
+
+
+def write_directory(dir1, files, rows, seed = 0):
+
+    os.makedirs(dir1, exist_ok = True)
+
+    for i in range(files):
+        write_trajectory(os.path.join(dir1, 'run%04d.CSV' % i), rows,
+                         seed + i)
+
+
+# timing
+
+# shortest of repeat runs of f(), in seconds
+
+def best_time(f, repeat):
+
+    best = None
+
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        f()
+        dt = time.perf_counter() - t0
+
+        if best is None or dt < best:
+            best = dt
+
+    return best
+
+
+# time of importing trajectory_classes in a new interpreter, and the
+# plotting libraries loaded by the import
+
+import_code = '''
+import sys
+import time
+t0 = time.perf_counter()
+import trajectory_classes
+print(time.perf_counter() - t0)
+print(' '.join(m for m in ['matplotlib', 'seaborn', 'mpl_toolkits.mplot3d']
+               if m in sys.modules))
+'''
+
+
+def import_time():
+
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    out = subprocess.run([sys.executable, '-c', import_code], cwd = here,
+                         check = True, capture_output = True,
+                         text = True).stdout.split('\n')
+
+    return float(out[0]), out[1].split()
+
+
+# time of every stage over all files of dir1, as a dict stage -> seconds
+
+def run_stages(dir1, plots, dpi, repeat):
+
+    times = {}
+
+    times['import'] = min(import_time()[0] for i in range(repeat))
+
+    files = sorted(f for f in os.listdir(dir1)
+                   if os.path.splitext(f)[-1] == '.CSV')
+    paths = [os.path.join(dir1, f) for f in files]
+
+    times['scan'] = best_time(lambda: tc.trajectory_dir(dir1), repeat)
+
+    # parsing without conversion, then the conversion alone
+
+    def parse():
+        return [trajectory_io.read_typed(f)[0] for f in paths]
+
+    times['parse'] = best_time(parse, repeat)
+
+    parsed = parse()
+
+    def convert_time():
+
+        seconds = 0.0
+
+        for data in parsed:
+            data = data.copy()
+
+            t0 = time.perf_counter()
+            trajectory_io.convert(data)
+            seconds += time.perf_counter() - t0
+
+        return seconds
+
+    times['rename/scale'] = min(convert_time() for i in range(repeat))
+
+    for f in paths:
+        trajectory_io.load_trajectory(f, cache = True)
+
+    times['load cached'] = best_time(
+        lambda: [trajectory_io.load_trajectory(f, cache = True)
+                 for f in paths], repeat)
+
+    times['summary'] = best_time(
+        lambda: [trajectory_io.summarize(f) for f in paths], repeat)
+
+    # plots: the reused figure of every plot kind is updated for every
+    # trajectory (plot), then saved at dpi (savefig). the plotting libraries
+    # are loaded first, so the first plot stage doesn't include the import
+
+    tc.load_plotting()
+
+    trajectories = [tc.trajectory(f) for f in paths]
+
+    for t in trajectories:
+        t.reuse_figures = True
+        t.save = False
+        t.dpi = dpi
+
+    for suffix in plots:
+
+        def plot():
+            for t in trajectories:
+                t.plot_spec(suffix)
+                figure(suffix, t).canvas.draw()
+
+        def savefig():
+            for t in trajectories:
+                figure(suffix, t).savefig(io.BytesIO(), dpi = dpi)
+
+        times['plot ' + suffix] = best_time(plot, repeat)
+        times['savefig ' + suffix] = best_time(savefig, repeat)
+
+    tc.figures.close()
+
+    return times
+
+
+# reused figure of a plot kind (see trajectory.plot_line / plot_line_3D)
+
+def figure(suffix, t):
+
+    if len(tc.line_specs[suffix][0]) == 3:
+        return tc.figures.get(suffix, None, '3d')[0]
+
+    return tc.figures.get(suffix, (t.figsizeX, t.figsizeY))[0]
+
+
+# baselines
+
+def read_baseline(path):
+
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def write_baseline(path, config, times):
+
+    with open(path, 'w') as fh:
+        json.dump({'config': config, 'times': times}, fh, indent = 1)
+
+
+# print the times next to the baseline and return the stages slower than
+# the baseline by more than threshold (a fraction) and more than min_delta
+# (seconds)
+
+def compare(times, baseline, threshold, min_delta = 0.005):
+
+    regressions = []
+
+    print('%-24s %10s %10s %8s' % ('stage', 'seconds', 'baseline', 'change'))
+
+    for stage in times:
+
+        line = '%-24s %10.4f' % (stage, times[stage])
+
+        if baseline is not None and stage in baseline['times']:
+
+            base = baseline['times'][stage]
+            change = times[stage] / base - 1 if base > 0 else 0.0
+
+            line += ' %10.4f %+7.1f%%' % (base, 100 * change)
+
+            if change > threshold and times[stage] - base > min_delta:
+                line += '  REGRESSION'
+                regressions.append(stage)
+
+        print(line)
+
+    return regressions
+
+
+def parse_args(argv):
+
+    p = argparse.ArgumentParser(
+        description = 'Time the stages of processing synthetic trajectories.')
+
+    p.add_argument('--rows', type = int, default = 15000,
+                   help = 'rows per trajectory file')
+    p.add_argument('--files', type = int, default = 4,
+                   help = 'number of trajectory files')
+    p.add_argument('--seed', type = int, default = 0)
+    p.add_argument('--dir', default = None,
+                   help = 'directory for the synthetic files (default: a '
+                          'temporary directory, removed afterwards)')
+    p.add_argument('-p', '--plots', nargs = '+',
+                   default = [plot[len('plot_'):]
+                              for plot in tc.separate_plots],
+                   help = 'plot kinds (line_specs suffixes) to time')
+    p.add_argument('--dpi', type = int, default = 300)
+    p.add_argument('--repeat', type = int, default = 3,
+                   help = 'runs of every stage; the shortest counts')
+    p.add_argument('--baseline', default = 'benchmark_baseline.json',
+                   help = 'file of the stored baseline')
+    p.add_argument('--save-baseline', action = 'store_true',
+                   help = 'store the times as the new baseline')
+    p.add_argument('--threshold', type = float, default = 0.2,
+                   help = 'slowdown counted as regression (0.2 = 20 %%)')
+    p.add_argument('--min-delta', type = float, default = 0.005,
+                   help = 'slowdowns shorter than this are never counted as '
+                          'regression, in seconds')
+    p.add_argument('--import-budget', type = float, default = 0.5,
+                   help = 'longest allowed import of trajectory_classes, in '
+                          'seconds')
+
+    return p.parse_args(argv)
+
+
+def main(argv = None):
+
+    args = parse_args(argv)
+
+    for suffix in args.plots:
+        if suffix not in tc.line_specs:
+            print('unknown plot: ' + suffix, file = sys.stderr)
+            return 2
+
+    tc.show_plots = False
+
+    dir1 = args.dir or tempfile.mkdtemp(prefix = 'trajectory_benchmark_')
+    dir1 = os.path.join(dir1, '')
+
+    config = {'rows': args.rows, 'files': args.files, 'seed': args.seed,
+              'dpi': args.dpi, 'plots': args.plots}
+
+    try:
+        write_directory(dir1, args.files, args.rows, args.seed)
+        times = run_stages(dir1, args.plots, args.dpi, args.repeat)
+    finally:
+        if args.dir is None:
+            shutil.rmtree(dir1, ignore_errors = True)
+
+    baseline = read_baseline(args.baseline)
+
+    if baseline is not None and baseline['config'] != config:
+        print('baseline was measured with different settings: '
+              + json.dumps(baseline['config']), file = sys.stderr)
+        baseline = None
+
+    regressions = compare(times, baseline, args.threshold,
+                          args.min_delta)
+
+    # the import is also held to a fixed budget and must not load the
+    # plotting libraries
+
+    loaded = import_time()[1]
+
+    if times['import'] > args.import_budget or loaded:
+        print('import took %.3f s (budget %.3f s)'
+              % (times['import'], args.import_budget)
+              + (', loaded ' + ', '.join(loaded) if loaded else ''),
+              file = sys.stderr)
+
+        if 'import' not in regressions:
+            regressions.append('import')
+
+    if args.save_baseline:
+        write_baseline(args.baseline, config, times)
+        print('Saved baseline ' + args.baseline)
+        return 0
+
+    if regressions:
+        print(str(len(regressions)) + ' stages regressed: '
+              + ', '.join(regressions), file = sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+# headless batch plotting of trajectory directories
+#
+# renders the separate plots of every trajectory and the combined plots of
+# every input directory with the non-interactive Agg backend, never shows a
+# figure and exits with status 1 if any plot failed. plots that are up to
+# date with their CSV files and settings are not rendered again unless
+# --force is given, e.g.
+#
+#   ./plot_batch.py WorkPackageM-20210521T090339Z-001/WorkPackageM/ \
+#       -o plots -p separate combined_end_2D --dpi 150 -j 8
+#
+# with --profile the load, transform, draw and save stages of every plot
+# are timed and written to a report (see trajectory_profile), e.g.
+#
+#   ./plot_batch.py runs/ -f --profile stages.csv --profile-dir prof
+#
+# with --archive the images of every input directory are written into one
+# zip or tar archive in its output directory instead of separate files
+# (see trajectory_archive), e.g.
+#
+#   ./plot_batch.py runs/ -o plots --archive plots.zip
+
+import matplotlib as mpl
+mpl.use('Agg')
+
+import os
+import sys
+import argparse
+
+import seaborn as sns
+
+import trajectory_classes as tc
+import trajectory_profile
+import trajectory_writer
+import trajectory_archive
+
+
+# palette of plot_all_combined.py
+
+palette1 = ['midnightblue','navy','darkblue','blue','slateblue','deepskyblue',
+            'cyan','fuchsia','orchid']
+
+
+def parse_args(argv):
+
+    p = argparse.ArgumentParser(
+        description = 'Render trajectory plots without a GUI.')
+
+    p.add_argument('dirs', nargs = '+', metavar = 'DIR',
+                   help = 'directories with trajectory CSV files')
+    p.add_argument('-o', '--output', default = '.',
+                   help = 'output directory (one subdirectory per input '
+                          'directory when several are given)')
+    p.add_argument('-p', '--plots', nargs = '+',
+                   default = ['separate', 'combined'],
+                   help = "plots to render: 'separate', 'combined' or plot "
+                          "names such as xt, 3D, dashboard, combined_xt; "
+                          "combined_dispersion is only drawn when named")
+    p.add_argument('--dpi', type = int, default = 300,
+                   help = 'resolution of saved figures')
+    p.add_argument('-j', '--workers', type = int, default = os.cpu_count(),
+                   help = 'number of worker processes')
+    p.add_argument('-f', '--force', action = 'store_true',
+                   help = 'render all plots, also those that are up to date')
+    p.add_argument('--decimate', action = 'store_true',
+                   help = 'draw only the points visible at the output '
+                          'resolution')
+    p.add_argument('--palette', default = ','.join(palette1),
+                   help = 'comma separated colors of the combined plots')
+    p.add_argument('--writers', type = int, default = 0,
+                   help = 'threads encoding and writing images in the '
+                          'background while the next plot is drawn '
+                          '(0: write directly)')
+    p.add_argument('--png-compression', type = int, default = None,
+                   choices = range(10), metavar = '0-9',
+                   help = 'PNG compression level; low levels are faster '
+                          'and make larger files, e.g. for drafts')
+    p.add_argument('--archive', default = None, metavar = 'NAME',
+                   help = 'write the images into archive NAME (.zip or '
+                          '.tar) in the output directory; always renders '
+                          'all plots')
+    p.add_argument('--profile', default = None, metavar = 'REPORT',
+                   help = 'time every stage and write the records to REPORT '
+                          '(CSV for a .csv file, otherwise JSON)')
+    p.add_argument('--profile-memory', action = 'store_true',
+                   help = 'also record the memory allocated in every stage '
+                          '(slow)')
+    p.add_argument('--profile-dir', default = None,
+                   help = 'directory for a cProfile dump of every stage')
+
+    return p.parse_args(argv)
+
+
+# plots of a single trajectory that can be selected
+
+single_plots = tc.separate_plots + tc.derived_plots + ['plot_dashboard']
+
+
+# split the plot selection into separate and combined plot methods
+
+def select_plots(names):
+
+    separate = []
+    combined = []
+
+    for name in names:
+
+        if name == 'separate':
+            separate += tc.separate_plots
+        elif name == 'combined':
+            combined += tc.combined_plots
+        elif 'plot_' + name in single_plots:
+            separate.append('plot_' + name)
+        elif 'plot_' + name in tc.combined_plots + tc.extra_combined_plots:
+            combined.append('plot_' + name)
+        else:
+            raise ValueError('unknown plot: ' + name)
+
+    # keep the order of first appearance, without duplicates
+
+    return list(dict.fromkeys(separate)), list(dict.fromkeys(combined))
+
+
+def main(argv = None):
+
+    args = parse_args(argv)
+
+    try:
+        separate, combined = select_plots(args.plots)
+    except ValueError as e:
+        print(e, file = sys.stderr)
+        return 2
+
+    if args.archive is not None:
+        try:
+            trajectory_archive.archive_format(args.archive)
+        except ValueError as e:
+            print(e, file = sys.stderr)
+            return 2
+
+    tc.show_plots = False
+    sns.set_palette(args.palette.split(','))
+
+    trajectory_writer.settings({'enabled': args.writers > 0,
+                                'threads': max(args.writers, 1),
+                                'queue': 4 * max(args.writers, 1),
+                                'compression': args.png_compression})
+
+    if args.profile or args.profile_dir:
+        trajectory_profile.enable(memory = args.profile_memory,
+                                  profile_dir = args.profile_dir)
+
+    failed = []
+
+    for dir1 in args.dirs:
+
+        outdir = args.output
+
+        if len(args.dirs) > 1:
+            outdir = os.path.join(outdir,
+                                  os.path.basename(os.path.normpath(dir1)))
+
+        os.makedirs(outdir, exist_ok = True)
+
+        try:
+            tdir = tc.trajectory_dir(os.path.join(dir1, ''))
+        except OSError as e:
+            print("Failed: " + dir1 + "\n" + str(e), file = sys.stderr)
+            failed.append((dir1, None, str(e)))
+            continue
+
+        tdir.dpi = args.dpi
+        tdir.outdir = outdir
+        tdir.decimation = args.decimate
+
+        archive = None
+
+        if args.archive is not None:
+            archive = os.path.join(outdir, args.archive)
+
+        # separate and combined plots as one batch
+
+        failed += tdir.plot_all(separate + combined, save = True,
+                                workers = args.workers,
+                                incremental = not args.force,
+                                archive = archive)
+
+    if trajectory_profile.enabled:
+        trajectory_profile.report(args.profile)
+
+    if failed:
+        print(str(len(failed)) + " plots failed", file = sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,608 @@
+#!/usr/bin/env python
+
+# local HTTP server rendering trajectory plots on request
+#
+# keeps the trajectory directories given on the command line loaded (as
+# memory mapped stores, or in shared memory with --share) and renders any
+# plot of any trajectory with any style when it is first requested, on a
+# pool of worker processes (the batch workers of trajectory_classes). the
+# encoded images are kept in an LRU cache bounded in bytes, keyed by the
+# trajectory, the plot, its spec and the style including the resolution;
+# a repeated request is answered from the cache without rendering (also
+# when it spells the same style differently), and identical requests
+# arriving while their image is being rendered wait for that one render
+# instead of starting their own. the size of the images and the figures
+# kept by the workers are bounded (see max_pixels, max_figures).
+#
+#   ./plot_server.py WorkPackageM-20210521T090339Z-001/WorkPackageM/ -j 4
+#
+# URLs (the dataset is the name of the directory, 'combined' the name of
+# the combined plots):
+#
+#   /                                       datasets, trajectories, plots
+#   /stats                                  cache and render counters
+#   /<dataset>/<trajectory>/<plot>.png      e.g. /WorkPackageM/1a/xt.png
+#   /<dataset>/combined/<plot>.png          e.g. /WorkPackageM/combined/alt.png
+#
+# the style is given in the query string: dpi, color, lw, width and height
+# (inches), decimate and envelopes (0 or 1), e.g.
+#
+#   /WorkPackageM/1a/alt.png?dpi=150&color=navy&lw=2
+#
+# the trajectory files are read once; restart the server after they change.
+
+import matplotlib as mpl
+mpl.use('Agg')
+
+import os
+import sys
+import json
+import signal
+import argparse
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl, unquote
+
+import trajectory_classes as tc
+import trajectory_profile
+import trajectory_writer
+from plot_batch import palette1
+
+
+# query parameters of the style: attribute, type, default of the separate
+# and of the combined plots (None where the plots have no such setting)
+
+def flag(value):
+
+    if value not in ('0', '1'):
+        raise ValueError('expected 0 or 1: ' + value)
+
+    return value == '1'
+
+
+style_params = OrderedDict([
+    ('dpi', ('dpi', int, 100, 100)),
+    ('color', ('color', str, tc.trajectory.color, None)),
+    ('lw', ('lw', float, tc.trajectory.lw, tc.trajectory_dir.lw)),
+    ('width', ('figsizeX', float, tc.trajectory.figsizeX,
+               tc.trajectory_dir.figsizeX)),
+    ('height', ('figsizeY', float, tc.trajectory.figsizeY,
+                tc.trajectory_dir.figsizeY)),
+    ('decimate', ('decimation', flag, False, False)),
+    ('envelopes', ('envelopes', flag, None, False)),
+])
+
+# limits of the rendered images: each side at least min_side pixels, at
+# most max_pixels in all (the RGBA buffer of a render takes 4 bytes per
+# pixel). every render worker keeps at most max_figures reused figures,
+# one per plot kind and size (see trajectory_classes.figure_pool)
+
+max_dpi = 600
+max_inches = 40
+min_side = 32
+max_pixels = 4096 * 4096
+max_figures = 8
+
+max_aliases = 100000      # request spellings remembered
+
+
+# figure size (inches) of plot method drawn with style
+
+def figure_inches(method, style):
+
+    if method == 'plot_dashboard':
+        n = len(tc.separate_plots)
+        ncols = 5
+        nrows = -(-n // ncols)
+        return (ncols * 0.75 * style['figsizeX'],
+                nrows * 0.75 * style['figsizeY'])
+
+    if family(method) == 'combined':
+        s = tc.plot_registry[method]
+
+        # 3D plots and points have the default size
+        if len(s.columns) == 3 or s.kind == 'points':
+            return tuple(mpl.rcParams['figure.figsize'])
+
+    return (style['figsizeX'], style['figsizeY'])
+
+
+# style settings of plot method from the query parameters; ValueError if
+# they are invalid or make an image too small or too large
+
+def parse_style(query, method):
+
+    combined = family(method) == 'combined'
+    family_name = 'combined' if combined else 'separate'
+    style = {'outdir': ''}
+
+    for param, (attr, kind, default, default_combined) in \
+            style_params.items():
+
+        if combined:
+            default = default_combined
+
+        if default is None:
+            if param in query:
+                raise ValueError(param + ' is not a setting of '
+                                 + family_name + ' plots')
+            continue
+
+        if param not in query:
+            style[attr] = default
+            continue
+
+        try:
+            style[attr] = kind(query[param])
+        except ValueError:
+            raise ValueError('invalid ' + param + ': ' + query[param])
+
+    unknown = set(query) - set(style_params)
+
+    if unknown:
+        raise ValueError('unknown parameters: ' + ', '.join(sorted(unknown)))
+
+    if not 10 <= style['dpi'] <= max_dpi:
+        raise ValueError('dpi must be between 10 and ' + str(max_dpi))
+
+    for attr in ['lw', 'figsizeX', 'figsizeY']:
+        if not 0 < style[attr] <= max_inches:
+            raise ValueError('invalid ' + attr + ': ' + str(style[attr]))
+
+    if 'color' in style:
+        import matplotlib.colors
+
+        if not matplotlib.colors.is_color_like(style['color']):
+            raise ValueError('invalid color: ' + style['color'])
+
+    w, h = [x * style['dpi'] for x in figure_inches(method, style)]
+
+    if min(w, h) < min_side:
+        raise ValueError('image smaller than ' + str(min_side) + ' pixels')
+
+    if w * h > max_pixels:
+        raise ValueError('image larger than ' + str(max_pixels) + ' pixels')
+
+    return style
+
+
+# family of a plot method (see trajectory_classes._family), None for
+# unknown plots
+
+def family(method):
+
+    try:
+        return tc._family(method)
+    except ValueError:
+        return None
+
+
+# failed render of a valid request
+
+class render_error(Exception):
+    pass
+
+
+# render workers of the server: the batch workers with a bounded figure
+# pool
+
+def _worker_init(figures, *args):
+
+    tc.figures.max_figures = figures
+    tc._worker_init(*args)
+
+
+# encoded images by key, least recently used first; the oldest images are
+# dropped when their total size exceeds max_bytes
+
+class image_cache:
+
+    def __init__(self, max_bytes):
+        self.images = OrderedDict()
+        self.max_bytes = max_bytes
+        self.bytes = 0
+
+
+    def get(self, key):
+
+        data = self.images.get(key)
+
+        if data is not None:
+            self.images.move_to_end(key)
+
+        return data
+
+
+    def put(self, key, data):
+
+        if len(data) > self.max_bytes:
+            return
+
+        if key in self.images:
+            self.bytes -= len(self.images.pop(key))
+
+        self.images[key] = data
+        self.bytes += len(data)
+
+        while self.bytes > self.max_bytes:
+            self.bytes -= len(self.images.popitem(last = False)[1])
+
+
+    def __len__(self):
+        return len(self.images)
+
+
+# the loaded datasets, the render workers and the image cache
+
+class render_server:
+
+    def __init__(self, dirs, workers = None, cache_bytes = 2**28,
+                 palette = palette1, share = False):
+
+        self.datasets = OrderedDict()
+        self.shared = []
+
+        for dir1 in dirs:
+
+            name = os.path.basename(os.path.normpath(dir1))
+
+            if name in self.datasets:
+                raise ValueError('two datasets named ' + name)
+
+            tdir = tc.trajectory_dir(os.path.join(dir1, ''), store = True)
+
+            if share:
+                self.shared.append(tdir.share())
+
+            self.datasets[name] = tdir
+
+        self.cache = image_cache(cache_bytes)
+        self.aliases = OrderedDict()  # request -> key of its image
+        self.pending = {}         # key -> future of the render in progress
+        self.lock = threading.Lock()
+        self.spec_keys = {}
+
+        self.counts = {'hits': 0, 'renders': 0, 'coalesced': 0,
+                       'failures': 0}
+
+        # the plotting libraries are loaded here once and inherited by the
+        # forked workers; the workers are started before any request
+        # thread exists
+
+        tc.load_plotting()
+
+        self.pool = ProcessPoolExecutor(
+            max_workers = workers or os.cpu_count(),
+            initializer = _worker_init,
+            initargs = (max_figures, palette, trajectory_profile.settings(),
+                        trajectory_writer.settings(), True))
+
+        self.pool.submit(os.getpid).result()
+
+
+    # plot method of plot of trajectory name in dataset; KeyError if there
+    # is no such dataset, trajectory or plot
+
+    def method(self, dataset, name, plot):
+
+        tdir = self.datasets[dataset]
+
+        if name == 'combined':
+            method = 'plot_combined_' + plot
+            expected = 'combined'
+        elif name in tdir.tdict:
+            method = 'plot_' + plot
+            expected = 'separate'
+        else:
+            raise KeyError(name)
+
+        if family(method) != expected:
+            raise KeyError(method)
+
+        return method
+
+
+    # render task of plot method of trajectory name in dataset
+
+    def task(self, dataset, name, method, style):
+
+        tdir = self.datasets[dataset]
+        store = tdir.worker_store()
+
+        if name == 'combined':
+            return (tc._render_combined, tdir.dir, method, style, True,
+                    store)
+
+        return (tc._render_separate, tdir.tdict.fpaths[name], method, style,
+                True, store)
+
+
+    # what a plot method draws, part of the keys of its images
+
+    def spec_key(self, method):
+
+        if method not in self.spec_keys:
+            self.spec_keys[method] = json.dumps(tc._plot_spec(method))
+
+        return self.spec_keys[method]
+
+
+    # remember the key of the image of a request (the requests spelling
+    # the same style differently share one image)
+
+    def alias(self, request, key):
+
+        self.aliases[request] = key
+        self.aliases.move_to_end(request)
+
+        while len(self.aliases) > max_aliases:
+            self.aliases.popitem(last = False)
+
+
+    # PNG image of plot (a plot name as in the file names: xt, 3D,
+    # dashboard; for name 'combined' the combined plots: xt, end_2D) of
+    # trajectory name in dataset with the style given by the query
+    # parameters, and how it was obtained ('hit', 'render' or
+    # 'coalesced'). the request is checked completely before rendering:
+    # raises KeyError for unknown datasets, trajectories and plots,
+    # ValueError for invalid styles and render_error if the render failed
+
+    def image(self, dataset, name, plot, query):
+
+        # a repeated request finds its image before anything is checked:
+        # only valid requests have aliases
+
+        request = (dataset, name, plot, tuple(sorted(query.items())))
+
+        with self.lock:
+
+            key = self.aliases.get(request)
+
+            if key is not None:
+                data = self.cache.get(key)
+
+                if data is not None:
+                    self.counts['hits'] += 1
+                    return data, 'hit'
+
+        if dataset not in self.datasets:
+            raise KeyError(dataset)
+
+        method = self.method(dataset, name, plot)
+        style = parse_style(query, method)
+
+        task = self.task(dataset, name, method, style)
+        key = (dataset, name, method, self.spec_key(method),
+               tuple(sorted(style.items())))
+
+        with self.lock:
+
+            self.alias(request, key)
+
+            data = self.cache.get(key)
+
+            if data is not None:
+                self.counts['hits'] += 1
+                return data, 'hit'
+
+            future = self.pending.get(key)
+
+            if future is None:
+                future = self.pool.submit(*task)
+                self.pending[key] = future
+                self.counts['renders'] += 1
+                how = 'render'
+                new = True
+            else:
+                self.counts['coalesced'] += 1
+                how = 'coalesced'
+                new = False
+
+        if new:
+            future.add_done_callback(lambda f: self.rendered(key, f))
+
+        try:
+            images = future.result()['images']
+        except Exception as e:
+            raise render_error(''.join(traceback.format_exception(e)))
+
+        if not images:
+            raise render_error('no image was rendered')
+
+        return images[0][1], how
+
+
+    # a render finished: cache its image; failed renders are not cached
+
+    def rendered(self, key, future):
+
+        with self.lock:
+
+            self.pending.pop(key, None)
+
+            if future.exception() is not None:
+                self.counts['failures'] += 1
+                return
+
+            images = future.result()['images']
+
+            if images:
+                self.cache.put(key, images[0][1])
+
+
+    # datasets with their trajectories and plots
+
+    def index(self):
+
+        separate = [p[len('plot_'):] for p in tc.separate_plots
+                    + tc.derived_plots + ['plot_dashboard']]
+        combined = [p[len('plot_combined_'):] for p in tc.combined_plots
+                    + tc.extra_combined_plots]
+
+        return {'datasets': {name: list(tdir.tdict.keys())
+                             for name, tdir in self.datasets.items()},
+                'plots': separate,
+                'combined_plots': combined,
+                'style': list(style_params)}
+
+
+    def stats(self):
+
+        with self.lock:
+            stats = dict(self.counts)
+            stats['images'] = len(self.cache)
+            stats['aliases'] = len(self.aliases)
+            stats['bytes'] = self.cache.bytes
+            stats['max_bytes'] = self.cache.max_bytes
+            stats['rendering'] = len(self.pending)
+
+        return stats
+
+
+    def close(self):
+
+        self.pool.shutdown(cancel_futures = True)
+
+        for shared in self.shared:
+            shared.close()
+
+        self.shared = []
+
+
+class handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'     # keep connections open
+    verbose = False
+
+
+    def do_GET(self):
+
+        render = self.server.render
+        url = urlsplit(self.path)
+        path = [unquote(p) for p in url.path.split('/') if p]
+
+        try:
+            query = dict(parse_qsl(url.query, strict_parsing = bool(url.query)))
+        except ValueError as e:
+            return self.reply(400, str(e))
+
+        if not path:
+            return self.reply_json(render.index())
+
+        if path == ['stats']:
+            return self.reply_json(render.stats())
+
+        if len(path) != 3 or not path[2].endswith('.png'):
+            return self.reply(404, 'not found: ' + url.path)
+
+        try:
+            data, how = render.image(path[0], path[1], path[2][:-len('.png')],
+                                     query)
+        except KeyError as e:
+            return self.reply(404, 'not found: ' + str(e))
+        except ValueError as e:
+            return self.reply(400, str(e))
+        except render_error as e:
+            return self.reply(500, str(e))
+        except Exception:
+            return self.reply(500, traceback.format_exc())
+
+        self.reply(200, data, 'image/png', {'X-Render': how})
+
+
+    def reply_json(self, obj):
+        self.reply(200, json.dumps(obj, indent = 1), 'application/json')
+
+
+    def reply(self, status, body, content_type = 'text/plain',
+              headers = {}):
+
+        if isinstance(body, str):
+            body = (body + '\n').encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+
+        for key in headers:
+            self.send_header(key, headers[key])
+
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+def parse_args(argv):
+
+    p = argparse.ArgumentParser(
+        description = 'Serve trajectory plots rendered on request.')
+
+    p.add_argument('dirs', nargs = '+', metavar = 'DIR',
+                   help = 'directories with trajectory CSV files')
+    p.add_argument('--host', default = '127.0.0.1')
+    p.add_argument('--port', type = int, default = 8000)
+    p.add_argument('-j', '--workers', type = int, default = os.cpu_count(),
+                   help = 'number of render processes')
+    p.add_argument('--cache-mb', type = float, default = 256,
+                   help = 'size of the image cache in MB')
+    p.add_argument('--palette', default = ','.join(palette1),
+                   help = 'comma separated colors of the combined plots')
+    p.add_argument('--share', action = 'store_true',
+                   help = 'keep the data in shared memory instead of '
+                          'mapping the stores')
+    p.add_argument('-v', '--verbose', action = 'store_true',
+                   help = 'log every request')
+
+    return p.parse_args(argv)
+
+
+def main(argv = None):
+
+    args = parse_args(argv)
+
+    tc.show_plots = False
+
+    try:
+        render = render_server(args.dirs, args.workers,
+                               int(args.cache_mb * 2**20),
+                               args.palette.split(','), args.share)
+    except (OSError, ValueError) as e:
+        print(e, file = sys.stderr)
+        return 2
+
+    handler.verbose = args.verbose
+
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    server.render = render
+
+    n = sum(len(tdir.tdict) for tdir in render.datasets.values())
+
+    print("Serving " + str(n) + " trajectories of "
+          + str(len(render.datasets)) + " datasets on http://" + args.host
+          + ":" + str(server.server_address[1]) + "/")
+
+    # stopped with Ctrl-C or a SIGTERM, the shared memory is freed
+
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        render.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,255 @@
+#!/usr/bin/python
+
+# archives of saved figures
+#
+# instead of one PNG file per plot, all images of a batch can be written
+# into a single uncompressed zip or tar archive (by the extension of its
+# path, .zip or .tar), which costs one file creation instead of hundreds.
+# the archive ends with an index (index.json) of its images: the
+# trajectory name ('combined' for the combined plots), the plot (the
+# suffix of the file name, e.g. 'alt' or 'xt'), the file name and size.
+#
+# while an archive is open (open_archive), trajectory_classes.savefig
+# adds the encoded images to it instead of writing files; batch worker
+# processes collect their images and send them back with the results of
+# their jobs. single images are read back by (trajectory, plot) without
+# unpacking the archive, e.g.
+#
+#   tdir.plot_all(workers = 4, archive = 'plots.zip')
+#
+#   with archive_reader('plots.zip') as a:
+#       png = a.read('1a', 'alt')
+#       a.extract('combined', 'xt', 'figures')
+
+import os
+import io
+import json
+import time
+import tarfile
+import zipfile
+import threading
+
+
+index_name = 'index.json'
+
+target = None             # where saved images go: an archive_writer, a
+                          # collector (batch workers) or None (files)
+
+
+def archive_format(path):
+
+    ext = os.path.splitext(path)[-1].lower()
+
+    if ext not in ('.zip', '.tar'):
+        raise ValueError(path + ': archives are .zip or .tar files')
+
+    return ext[1:]
+
+
+class archive_writer:
+
+    def __init__(self, path):
+        self.path = path
+        self.format = archive_format(path)
+        self.entries = {}         # 'trajectory/plot' -> index entry
+        self.lock = threading.Lock()
+
+        if self.format == 'zip':
+            # PNG data doesn't compress any further
+            self.archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED)
+        else:
+            self.archive = tarfile.open(path, 'w')
+
+
+    # add the encoded image data of plot of trajectory name as file arcname
+
+    def add(self, arcname, data, name, plot):
+
+        with self.lock:
+
+            if self.format == 'zip':
+                info = zipfile.ZipInfo(arcname,
+                                       time.localtime(time.time())[:6])
+                self.archive.writestr(info, data)
+            else:
+                info = tarfile.TarInfo(arcname)
+                info.size = len(data)
+                info.mtime = time.time()
+                self.archive.addfile(info, io.BytesIO(data))
+
+            self.entries[name + '/' + plot] = {'trajectory': name,
+                                               'plot': plot,
+                                               'file': arcname,
+                                               'size': len(data)}
+
+
+    # write the index and close the archive
+
+    def close(self):
+
+        with self.lock:
+
+            if self.archive is None:
+                return
+
+            index = json.dumps({'images': list(self.entries.values())},
+                               indent = 1).encode()
+
+            if self.format == 'zip':
+                self.archive.writestr(index_name, index)
+            else:
+                info = tarfile.TarInfo(index_name)
+                info.size = len(index)
+                info.mtime = time.time()
+                self.archive.addfile(info, io.BytesIO(index))
+
+            self.archive.close()
+            self.archive = None
+
+        print("Archived " + str(len(self.entries)) + " images in "
+              + self.path)
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# images of a batch worker process, sent back with the job results
+
+class collector:
+
+    def __init__(self):
+        self.images = []
+        self.lock = threading.Lock()
+
+    def add(self, arcname, data, name, plot):
+        with self.lock:
+            self.images.append((arcname, data, name, plot))
+
+    # the images collected since the last call
+
+    def take(self):
+        with self.lock:
+            images = self.images
+            self.images = []
+
+        return images
+
+
+# send the saved images to a new archive at path until the archive is
+# closed (also used in a with statement)
+
+class open_archive(archive_writer):
+
+    def __init__(self, path):
+        global target
+
+        if target is not None:
+            raise ValueError('an archive is already open: ' + target.path)
+
+        archive_writer.__init__(self, path)
+        target = self
+
+
+    def close(self):
+        global target
+
+        try:
+            archive_writer.close(self)
+        finally:
+            if target is self:
+                target = None
+
+
+# function taking the encoded data of an image saved to path (the plot of
+# trajectory name), or None if images are written to files
+
+def sink(path, name, plot):
+
+    if target is None:
+        return None
+
+    current = target
+
+    def add(data):
+        current.add(os.path.basename(path), data, name, plot)
+
+    return add
+
+
+# random access to the images of an archive by (trajectory, plot)
+
+class archive_reader:
+
+    def __init__(self, path):
+        self.path = path
+        self.format = archive_format(path)
+
+        if self.format == 'zip':
+            self.archive = zipfile.ZipFile(path)
+        else:
+            self.archive = tarfile.open(path, 'r:')
+
+        index = json.loads(self.member(index_name))
+
+        self.entries = {(e['trajectory'], e['plot']): e
+                        for e in index['images']}
+
+
+    def member(self, arcname):
+
+        if self.format == 'zip':
+            return self.archive.read(arcname)
+
+        return self.archive.extractfile(arcname).read()
+
+
+    # (trajectory, plot) of every image
+
+    def keys(self):
+        return list(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    # encoded image of plot of trajectory name
+
+    def read(self, name, plot):
+
+        if (name, plot) not in self.entries:
+            raise KeyError(name + '/' + plot + ' is not in ' + self.path)
+
+        return self.member(self.entries[(name, plot)]['file'])
+
+
+    # write the image of plot of trajectory name to outdir and return its
+    # path
+
+    def extract(self, name, plot, outdir = '.'):
+
+        data = self.read(name, plot)
+        path = os.path.join(outdir, self.entries[(name, plot)]['file'])
+
+        os.makedirs(outdir, exist_ok = True)
+
+        with open(path, 'wb') as fh:
+            fh.write(data)
+
+        return path
+
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -8,25 +8,376 @@
 # load necessary libraries
 
 import pandas as pd
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-import seaborn as sns
-from mpl_toolkits.mplot3d import Axes3D
+import numpy as np
 
 import os
+import io
+import json
+import hashlib
+import importlib
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
-# apply seaborn styles
+from trajectory_io import load_trajectory, iter_chunks, running_summary, \
+                          read_catalog, file_hash, tail, write_atomic
+from trajectory_decimate import decimate
+from trajectory_store import load_store, share_frames, attach_store, \
+                             shared_store
+from trajectory_derived import derived, labels
+from trajectory_ensemble import align
+from trajectory_dispersion import read_dispersion
+import trajectory_profile
+from trajectory_profile import stage
+import trajectory_writer
+import trajectory_archive
+
+# plotting libraries
+#
+# matplotlib, seaborn and mplot3d are imported, and the seaborn styles
+# applied, only when a plot is first drawn (or any of the names below is
+# first used), so that scripts and worker processes that only load or
+# summarize trajectories don't pay for them
+
+plotting_loaded = False
+
+
+def load_plotting():
+    global plotting_loaded
+    
+    if plotting_loaded:
+        return
+    
+    import matplotlib.pyplot
+    import seaborn
+    
+    # apply seaborn styles
+    
+    seaborn.set_context('talk')
+    seaborn.set_style('darkgrid')
+    
+    plotting_loaded = True
+    
+    
+# stand-in for a module, or a name in a module, imported on first use
+
+class lazy:
+    
+    def __init__(self, module, name = None):
+        self._module = module
+        self._name = name
+        self._target = None
+        
+        
+    def _load(self):
+        
+        if self._target is None:
+            
+            load_plotting()
+            
+            target = importlib.import_module(self._module)
+            
+            if self._name is not None:
+                target = getattr(target, self._name)
+                
+            self._target = target
+            
+        return self._target
+    
+    
+    def __getattr__(self, attr):
+        
+        if attr in ('_module', '_name', '_target'):
+            raise AttributeError(attr)
+        
+        return getattr(self._load(), attr)
+    
+    
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+    
+    
+mpl = lazy('matplotlib')
+plt = lazy('matplotlib.pyplot')
+sns = lazy('seaborn')
+Figure = lazy('matplotlib.figure', 'Figure')
+LineCollection = lazy('matplotlib.collections', 'LineCollection')
+LogNorm = lazy('matplotlib.colors', 'LogNorm')
+Circle = lazy('matplotlib.patches', 'Circle')
+Ellipse = lazy('matplotlib.patches', 'Ellipse')
+Axes3D = lazy('mpl_toolkits.mplot3d', 'Axes3D')
+Line3DCollection = lazy('mpl_toolkits.mplot3d.art3d', 'Line3DCollection')
+
+
+# plot registry
+#
+# every plot is one entry, by the name of its plot method:
+#
+#   family    'separate': one figure per trajectory, <fname>_<suffix>.png
+#             'combined': all trajectories of a directory in one figure,
+#                         combined_<suffix>.png (unless output is given)
+#   kind      'line': one column against another (a 3D line for three
+#             columns), 'points': summary columns of every trajectory,
+#             'dispersion': impact dispersion (combined only)
+#   columns, labels
+#             data columns and axis labels, x, y (and z)
+#   batch     part of the default batch of its family (plot_all_separate,
+#             plot_all_combined)
+#
+# the plot methods of trajectory and trajectory_dir (plot_xt,
+# plot_combined_xt, ...) are generated from the registry and all drawn by
+# trajectory.plot_spec and trajectory_dir.plot_combined, so a new plot is
+# one entry here.
+
+class spec:
+    
+    def __init__(self, family, suffix, columns, labels, kind = 'line',
+                 output = None, batch = True):
+        self.family = family
+        self.suffix = suffix
+        self.columns = columns
+        self.labels = labels
+        self.kind = kind
+        self.batch = batch
+        
+        if family == 'separate':
+            self.name = 'plot_' + suffix
+            self.output = None
+        else:
+            self.name = 'plot_combined_' + suffix
+            self.output = output or 'combined_' + suffix + '.png'
+            
+            
+def _specs(family, entries, **kwargs):
+    return [spec(family, *entry, **kwargs) for entry in entries]
+
+
+plot_registry = OrderedDict((s.name, s) for s in 
+    
+    # plots of a single trajectory
+    
+    _specs('separate', [
+        ('xt', ('Time', 'X Position'), ('Time, s', 'X Position, km')),
+        ('yt', ('Time', 'Y Position'), ('Time, s', 'Y Position, km')),
+        ('zt', ('Time', 'Z Position'), ('Time, s', 'Z Position, km')),
+        ('grt', ('Time', 'Ground Range'), ('Time, s', 'Ground Range, km')),
+        ('alt', ('Time', 'Altitude'), ('Time, s', 'Altitude, km')),
+        ('drt', ('Time', 'Downrange'), ('Time, s', 'Downrange, km')),
+        ('crt', ('Time', 'Crossrange'), ('Time, s', 'Crossrange, km')),
+        ('vt', ('Time', 'Velocity'), 
+               ('Time, s', 'Earth relative velocity, m/s')),
+        ('at', ('Time', 'Acceleration'), ('Time, s', 'Acceleration, m/s$^2$')),
+        ('axt', ('Time', 'Acceleration X'), 
+                ('Time, s', 'Acceleration X, m/s$^2$')),
+        ('ayt', ('Time', 'Acceleration Y'), 
+                ('Time, s', 'Acceleration Y, m/s$^2$')),
+        ('azt', ('Time', 'Acceleration Z'), 
+                ('Time, s', 'Acceleration Z, m/s$^2$')),
+        ('pat', ('Time', 'Pitch Angle'), ('Time, s', 'Pitch Angle, deg')),
+        ('hat', ('Time', 'Heading Angle'), ('Time, s', 'Heading Angle, deg')),
+        ('mt', ('Time', 'Mach'), ('Time, s', 'Mach')),
+        ('am', ('Mach', 'Altitude'), ('Mach', 'Altitude, km')),
+        ('av', ('Velocity', 'Altitude'), ('Velocity, m/s', 'Altitude, km')),
+        ('xyz', ('X Position', 'Y Position', 'Z Position'),
+                ('X, km', 'Y, km', 'Z, km')),
+        ('3D', ('Downrange', 'Crossrange', 'Altitude'),
+               ('Downrange, km', 'Crossrange, km', 'Altitude, km'))])
+    
+    # derived quantities (see trajectory_derived), not drawn by default
+    
+    + _specs('separate', [
+        ('qt', ('Time', 'Dynamic Pressure'), 
+               ('Time, s', labels['Dynamic Pressure'])),
+        ('fpat', ('Time', 'Flight Path Angle'), 
+                 ('Time, s', labels['Flight Path Angle'])),
+        ('et', ('Time', 'Specific Energy'), 
+               ('Time, s', labels['Specific Energy'])),
+        ('jt', ('Time', 'Jerk'), ('Time, s', labels['Jerk'])),
+        ('rrt', ('Time', 'Range Rate'), ('Time, s', labels['Range Rate'])),
+        ('gt', ('Time', 'G Load'), ('Time, s', labels['G Load']))],
+        batch = False)
+    
+    # plots of all trajectories of a directory
+    
+    + _specs('combined', [
+        ('xt', ('Time', 'X Position'), ('Time, s', 'X Position, km')),
+        ('yt', ('Time', 'Y Position'), ('Time, s', 'Y Position, km')),
+        ('zt', ('Time', 'Z Position'), ('Time, s', 'Z Position, km')),
+        ('grt', ('Time', 'Ground Range'), ('Time, s', 'Ground Range, km')),
+        ('alt', ('Time', 'Altitude'), ('Time, s', 'Altitude, km')),
+        ('drt', ('Time', 'Downrange'), ('Time, s', 'Downrange, km')),
+        ('crt', ('Time', 'Crossrange'), ('Time, s', 'Crossrange, km')),
+        ('vt', ('Time', 'Velocity'), ('Time, s', 'Velocity, m/s')),
+        ('at', ('Time', 'Acceleration'), ('Time, s', 'Acceleration, m/s$^2$')),
+        ('axt', ('Time', 'Acceleration X'), 
+                ('Time, s', 'Acceleration X, m/s$^2$')),
+        ('ayt', ('Time', 'Acceleration Y'), 
+                ('Time, s', 'Acceleration Y, m/s$^2$')),
+        ('azt', ('Time', 'Acceleration Z'), 
+                ('Time, s', 'Acceleration Z, m/s$^2$')),
+        ('pat', ('Time', 'Pitch Angle'), ('Time, s', 'Pitch Angle, deg')),
+        ('hat', ('Time', 'Heading Angle'), ('Time, s', 'Heading Angle, deg')),
+        ('mt', ('Time', 'Mach'), ('Time, s', 'Mach')),
+        ('am', ('Mach', 'Altitude'), ('Mach', 'Altitude, km')),
+        ('av', ('Velocity', 'Altitude'), ('Velocity, m/s', 'Altitude, km')),
+        ('agr', ('Ground Range', 'Altitude'), 
+                ('Ground Range, km', 'Altitude, km')),
+        ('xyz', ('X Position', 'Y Position', 'Z Position'),
+                ('X, km', 'Y, km', 'Z, km')),
+        ('3D', ('Downrange', 'Crossrange', 'Altitude'),
+               ('Downrange, km', 'Crossrange, km', 'Altitude, km'))])
+    
+    + [spec('combined', 'end_2D', ('Final Downrange', 'Final Crossrange'),
+            ('Downrange, km', 'Crossrange, km'), kind = 'points'),
+       spec('combined', 'end_xyz', 
+            ('Final X Position', 'Final Y Position', 'Final Z Position'),
+            ('X Position, km', 'Y Position, km', 'Z Position, km'),
+            kind = 'points', output = 'combined_end_3D.png'),
+       spec('combined', 'dispersion', ('Final Downrange', 'Final Crossrange'),
+            ('Downrange, km', 'Crossrange, km'), kind = 'dispersion',
+            batch = False)])
+
+
+# columns and axis labels of the plots of a single trajectory, by the
+# suffix of their file name; three columns make a 3D plot
+
+line_specs = OrderedDict((s.suffix, (s.columns, s.labels)) 
+                         for s in plot_registry.values() 
+                         if s.family == 'separate')
+
+# plots produced for every trajectory by trajectory_dir.plot_all_separate
+
+separate_plots = [s.name for s in plot_registry.values() 
+                  if s.family == 'separate' and s.batch]
+
+# plots of the derived quantities (see trajectory_derived)
+
+derived_plots = [s.name for s in plot_registry.values() 
+                 if s.family == 'separate' and not s.batch]
+
+# plots produced for a whole directory by trajectory_dir.plot_all_combined
+
+combined_plots = [s.name for s in plot_registry.values() 
+                  if s.family == 'combined' and s.batch]
+
+# combined plots drawn only when asked for (plots = [...]): the impact
+# dispersion, which reads the final points of every trajectory
+
+extra_combined_plots = [s.name for s in plot_registry.values() 
+                        if s.family == 'combined' and not s.batch]
+
+# file names of the combined plots
+
+combined_outputs = {s.name: s.output for s in plot_registry.values() 
+                    if s.family == 'combined'}
+
+
+# figures kept for reuse, one per plot kind
+#
+# the figures are created directly (not through pyplot), so they are never
+# shown and don't accumulate in pyplot; close() releases all of them.
+# with max_figures set, only that many figures are kept and the least
+# recently used one is dropped for a new one (e.g. for long running
+# processes drawing many figure sizes)
+
+class figure_pool:
+    
+    max_figures = None
+    
+    def __init__(self):
+        self.figures = OrderedDict()  # (kind, figsize, projection) ->
+                                      # [fig, ax, line]
+        
+        
+    # [figure, axes, line] of a plot kind; line is None until the first
+    # plot and is stored back into the list by the caller
+    
+    def get(self, kind, figsize = None, projection = None):
+        
+        key = (kind, figsize, projection)
+        
+        if key in self.figures:
+            self.figures.move_to_end(key)
+        else:
+            fig = Figure(figsize = figsize)
+            ax = fig.add_subplot(projection = projection)
+            self.figures[key] = [fig, ax, None]
+            
+            if self.max_figures is not None:
+                while len(self.figures) > max(self.max_figures, 1):
+                    self.figures.popitem(last = False)
+            
+        return self.figures[key]
+    
+    
+    def close(self):
+        self.figures.clear()
+        
+        
+figures = figure_pool()
+
+
+# n colors of the current color cycle, repeated as needed
+
+def line_colors(n):
+    
+    colors = mpl.rcParams['axes.prop_cycle'].by_key()['color']
+    
+    return [colors[i % len(colors)] for i in range(n)]
+
+
+# show a pyplot figure and close it afterwards; show_plots = False never
+# shows figures (batch runs)
+
+show_plots = True
+
+def show(fig):
+    
+    if show_plots:
+        plt.show()
+        
+    plt.close(fig)
+
+
+# save a figure, timed as the save stage of trajectory name and plot (see
+# trajectory_profile); with the writer enabled the figure is only rendered
+# here and written in the background (see trajectory_writer), with an
+# archive open it is added to the archive instead of written to path (see
+# trajectory_archive)
+
+def savefig(fig, path, dpi, name = '', plot = ''):
+    
+    with stage('save', name, plot):
+        
+        sink = trajectory_archive.sink(path, name, plot)
+        kwargs = trajectory_writer.savefig_kwargs()
+        
+        if trajectory_writer.enabled:
+            trajectory_writer.submit(fig, path, dpi, sink)
+        elif sink is not None:
+            buf = io.BytesIO()
+            fig.savefig(buf, format = 'png', dpi = dpi, **kwargs)
+            sink(buf.getvalue())
+        else:
+            fig.savefig(path, dpi = dpi, **kwargs)
 
-sns.set_context('talk')
-sns.set_style('darkgrid')
 
 class trajectory:
     
     data = pd.DataFrame()     #trajectory data
     fpath = ""                #file path
     fname = ""
+    stream = False            # data read chunk by chunk instead of loaded
+    summary_data = None       # summary() of the trajectory
+    live_reader = None        # tail of a file still being written
     save = False              # save plots to files (don't save by default)
     dpi = 300                 # resolution of figures
+    outdir = ''               # directory of saved figures
+    reuse_figures = False     # redraw one figure per plot kind (see below)
+    decimation = False        # draw only the points visible at the figure's
+                              # pixel resolution (see trajectory_decimate)
+    on_resize = None          # called when columns are added to the data
+                              # (see trajectory_lru)
     
     # default plot parameters
     
@@ -36,38 +387,87 @@ class trajectory:
     figsizeY = 4.8
     
     
-    def __init__(self,f):
+    def __init__(self, f, cache = None, stream = False, data = None,
+                 live = False):
         self.fpath = f  # save file path
         bn = os.path.basename(f)
         self.fname = os.path.splitext(bn)[0]
         
-        self.data = pd.read_csv(f)
-        self.data.rename(columns = {'TTIME_S':'Time',
-                                    'TRXI_M':'X Position', 
-                                    'TRYI_M':'Y Position', 
-                                    'TRZI_M':'Z Position',
-                                    'TGRNKM_KM':'Ground Range', 
-                                    'TALTKM_KM':'Altitude',
-                                    'TDRNGE_M':'Downrange',
-                                    'TCRNGE_M':'Crossrange',
-                                    'TVRMAG_M/S':'Velocity',
-                                    'TAIMAG_M/S2':'Acceleration',
-                                    'TABXB_M/S2':'Acceleration X',
-                                    'TABYB_M/S2':'Acceleration Y',
-                                    'TABZB_M/S2':'Acceleration Z',
-                                    'TPITCH_DEG':'Pitch Angle',
-                                    'THEADG_DEG':'Heading Angle', 
-                                    'TAMACH':'Mach'
-                                                                   }, inplace = True)
+        # stream = True doesn't load the data; the file is only read chunk
+        # by chunk by chunks() and summary(), for files larger than memory
+        
+        self.stream = stream
+        
+        if stream:
+            return
         
-        # convert X, Y, Z positions, crossrange and downrange to km
+        # data already loaded elsewhere, e.g. a view of a trajectory_store
         
-        self.data['X Position'] = self.data['X Position'] * 1e-3
-        self.data['Y Position'] = self.data['Y Position'] * 1e-3
-        self.data['Z Position'] = self.data['Z Position'] * 1e-3
+        if data is not None:
+            self.data = data
+            return
         
-        self.data['Downrange'] = self.data['Downrange'] * 1e-3
-        self.data['Crossrange'] = self.data['Crossrange'] * 1e-3
+        # live = True follows a file still being written by the simulator,
+        # see follow()
+        
+        if live:
+            self.follow()
+            return
+        
+        # parse the file (or load it from the binary cache), rename the
+        # columns and convert X, Y, Z positions, crossrange and downrange to km
+        
+        self.data = load_trajectory(f, cache)
+        
+        
+    # read the rows appended to the file since the last call (live
+    # trajectories) and return their number; only the new rows are parsed
+    
+    def follow(self):
+        
+        if self.live_reader is None:
+            self.live_reader = tail(self.fpath)
+            
+        n = self.live_reader.read()
+        
+        if n:
+            self.data = self.live_reader.frame()
+            self.summary_data = None
+            
+        return n
+        
+        
+    # iterate over the data in chunks of rows (read from the file for
+    # streamed trajectories)
+    
+    def chunks(self, rows = None):
+        
+        if self.stream:
+            yield from iter_chunks(self.fpath, rows)
+            return
+        
+        if rows is None:
+            rows = len(self.data)
+            
+        for i in range(0, len(self.data), max(rows, 1)):
+            yield self.data.iloc[i:i + rows]
+            
+            
+    # summary of the trajectory: time window, apogee, max Mach, velocity and
+    # acceleration and the final position (computed once, chunk by chunk)
+    
+    def summary(self):
+        
+        if self.summary_data is None:
+            
+            s = running_summary()
+            
+            for chunk in self.chunks():
+                s.update(chunk)
+                
+            self.summary_data = s.result()
+            
+        return self.summary_data
         
         
         
@@ -88,503 +488,586 @@ class trajectory:
         
     def disable_saving(self):
         self.save = False
+        
+    def enable_figure_reuse(self):
+        self.reuse_figures = True
+        
+    def disable_figure_reuse(self):
+        self.reuse_figures = False
+        
+    def enable_decimation(self):
+        self.decimation = True
+        
+    def disable_decimation(self):
+        self.decimation = False
     
         
     # plotting functions
+    #
+    # every plot is drawn by plot_line / plot_line_3D. with figure reuse
+    # enabled (enable_figure_reuse) the figure of each plot kind is created
+    # once, outside pyplot, and only its line data and limits are updated
+    # for the next trajectory; it is saved but not shown. otherwise a new
+    # pyplot figure is shown and closed afterwards.
     
     
+    # file name of a saved plot
     
-    # Time plots
+    def output(self, suffix):
+        return os.path.join(self.outdir, self.fname + '_' + suffix + '.png')
     
-   
-    # X vs Time
     
-    def plot_xt(self):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        plt.plot(
-            'Time',
-            'X Position', 
-            data=self.data, 
-            marker= None , color= self.color, lw = self.lw
-            )
-        
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "X Position, km"
-            )
-
+    # add the derived quantities (see trajectory_derived) among columns
+    # that are not in the data yet as new columns and return the data
+    
+    def derive(self, columns):
         
+        added = False
         
-        if self.save:
-            plt.savefig(self.fname + '_xt.png',dpi = 300)
+        for c in columns:
+            if c not in self.data and c in derived:
+                self.data[c] = derived[c](self.data)
+                added = True
+                
+        if added and self.on_resize is not None:
+            self.on_resize()
             
-        plt.show()
+        return self.data
+    
+    
+    # data to plot the given columns, decimated to the pixel resolution of
+    # axes ax (or of a figure figwidth inches wide) when decimation is
+    # enabled
+    
+    def plot_data(self, columns, figwidth = None, ax = None):
         
+        with stage('transform', self.fname):
+            
+            data = self.derive(columns)
+            
+            if not self.decimation:
+                return data
+            
+            return decimate(data, columns, figwidth, self.dpi, ax)
         
         
-    # Y vs Time
+    # draw the separate plot with the given suffix (see plot_registry);
+    # the plot methods (plot_xt, ...) call this
     
-    def plot_yt(self):
+    def plot_spec(self, suffix):
         
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        plt.plot(
-            'Time',
-            'Y Position', 
-            data=self.data, 
-            marker= None , color= self.color, lw = self.lw
-            )
+        s = plot_registry['plot_' + suffix]
         
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Y Position, km"
-            )
+        with stage('draw', self.fname, suffix):
+            
+            if len(s.columns) == 3:
+                self.plot_line_3D(*s.columns, *s.labels, suffix)
+            else:
+                self.plot_line(*s.columns, *s.labels, suffix)
+            
+            
+    # draw y against x and save the figure as <fname>_<suffix>.png
+    
+    def plot_line(self, x, y, xlabel, ylabel, suffix):
         
-        if self.save:
-            plt.savefig(self.fname + '_yt.png',dpi = 300)
+        if self.reuse_figures:
             
-       
-        plt.show()
+            entry = figures.get(suffix, (self.figsizeX,self.figsizeY))
+            fig, ax, line = entry
+            
+            data = self.plot_data([x, y], ax = ax)
+            
+            if line is None:
+                line, = ax.plot(data[x], data[y], marker = None)
+                ax.set(xlabel = xlabel, ylabel = ylabel)
+                entry[2] = line
+            else:
+                line.set_data(data[x], data[y])
+                ax.relim()
+                ax.autoscale_view()
+                
+            line.set_color(self.color)
+            line.set_linewidth(self.lw)
+            
+            if self.save:
+                savefig(fig, self.output(suffix), self.dpi, self.fname,
+                        suffix)
+                
+            return
         
-    # Z vs Time
-    
-    def plot_zt(self):
         
         fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
         
+        data = self.plot_data([x, y], ax = ax)
+        
         plt.plot(
-            'Time',
-            'Z Position', 
-            data=self.data, 
+            x,
+            y, 
+            data=data, 
             marker= None , color= self.color, lw = self.lw
             )
         
         ax.set(
-            xlabel = "Time, s",
-            ylabel = "Z Position, km"
+            xlabel = xlabel,
+            ylabel = ylabel
             )
         
         if self.save:
-            plt.savefig(self.fname + '_zt.png',dpi = 300)
+            savefig(fig, self.output(suffix), self.dpi, self.fname, suffix)
             
+        show(fig)
         
-        plt.show()
         
-    # Ground Range vs Time
+    # draw a 3D line and save the figure as <fname>_<suffix>.png
     
-    def plot_grt(self):
+    def plot_line_3D(self, x, y, z, xlabel, ylabel, zlabel, suffix):
         
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
+        if self.reuse_figures:
+            
+            entry = figures.get(suffix, None, '3d')
+            fig, ax, line = entry
+            
+            data = self.plot_data([x, y, z], ax = ax)
+            
+            if line is None:
+                line, = ax.plot(data[x], data[y], data[z])
+                ax.set(xlabel = xlabel, ylabel = ylabel, zlabel = zlabel)
+                entry[2] = line
+            else:
+                line.set_data_3d(data[x], data[y], data[z])
+                ax.auto_scale_xyz(data[x], data[y], data[z], had_data = False)
+                
+            line.set_color(self.color)
+            line.set_linewidth(self.lw)
+            
+            if self.save:
+                savefig(fig, self.output(suffix), self.dpi, self.fname,
+                        suffix)
+                
+            return
         
-        plt.plot(
-            'Time',
-            'Ground Range', 
-            data=self.data, 
-            marker= None , color= self.color, lw = self.lw
+        
+        #fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
+        ax = plt.figure().add_subplot(projection='3d')
+        
+        data = self.plot_data([x, y, z], ax = ax)
+        
+        ax.plot(
+            data[x],
+            data[y],
+            data[z],
+            color = self.color,
+            lw = self.lw
             )
         
         ax.set(
-            xlabel = "Time, s",
-            ylabel = "Ground Range, km"
+            xlabel = xlabel,
+            ylabel = ylabel,
+            zlabel = zlabel
             )
         
         if self.save:
-            plt.savefig(self.fname + '_grt.png',dpi = 300)
+            savefig(ax.figure, self.output(suffix), self.dpi, self.fname,
+                    suffix)
             
+        show(ax.figure)
+        
         
-        plt.show()
     
-    # Altitude vs Time
+    # all plots of the trajectory in a single figure (one panel per plot,
+    # 3D plots included) saved once as <fname>_dashboard.png
+    # panels is a list of line_specs suffixes, by default the plots of
+    # separate_plots
     
-    def plot_alt(self):
+    def plot_dashboard(self, panels = None, ncols = 5):
         
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
+        with stage('draw', self.fname, 'dashboard'):
+            
+            if panels is None:
+                panels = [plot[len('plot_'):] for plot in separate_plots]
+                
+            nrows = -(-len(panels) // ncols)
+            
+            # panels are 3/4 of the size of a separate plot
+            
+            panelX = 0.75 * self.figsizeX
+            panelY = 0.75 * self.figsizeY
+            
+            # a fixed grid instead of an automatic layout, which would cost
+            # about as much as drawing the panels
+            
+            if show_plots:
+                fig = plt.figure(figsize = (ncols * panelX, nrows * panelY))
+            else:
+                fig = Figure(figsize = (ncols * panelX, nrows * panelY))
+                
+            fig.subplots_adjust(left = 1.5 / (ncols * panelX), 
+                                right = 1 - 0.2 / (ncols * panelX),
+                                bottom = 0.9 / (nrows * panelY),
+                                top = 1 - 0.6 / (nrows * panelY),
+                                wspace = 0.55, hspace = 0.5)
+            
+            for i, suffix in enumerate(panels):
+                
+                columns, axlabels = line_specs[suffix]
+                
+                if len(columns) == 3:
+                    ax = fig.add_subplot(nrows, ncols, i + 1,
+                                         projection = '3d')
+                    ax.set(zlabel = axlabels[2])
+                else:
+                    ax = fig.add_subplot(nrows, ncols, i + 1)
+                
+                data = self.plot_data(list(columns), ax = ax)
+                
+                ax.plot(*[data[c] for c in columns], 
+                        color = self.color, lw = self.lw)
+                
+                ax.set(xlabel = axlabels[0], ylabel = axlabels[1])
+                
+            fig.suptitle(self.fname)
+            
+            if self.save:
+                savefig(fig, self.output('dashboard'), self.dpi, self.fname,
+                        'dashboard')
+                
+            show(fig)
         
-        plt.plot(
-            'Time',
-            'Altitude', 
-            data=self.data, 
-            marker= None , color= self.color, lw = self.lw
-            )
         
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Altitude, km"
-            )
         
-        if self.save:
-            plt.savefig(self.fname + '_alt.png',dpi = 300)
-            
+# live view of a trajectory that is still being written
+#
+# shows the 2D plots of line_specs (by suffix) of a live trajectory and
+# refreshes them fps times per second with the rows appended since the last
+# frame. the axes are blitted: only the new part of each line is drawn on
+# top of the saved image of the axes, so a frame costs time proportional
+# to the new rows. only when a line leaves the axis limits are the limits
+# extended (with headroom for further growth) and the figure redrawn.
+#
+#   t = trajectory('run.CSV', live = True)
+#   live_plot(t, ['alt', 'vt', 'mt']).run()
+
+class live_plot:
+    
+    headroom = 0.25           # fraction of the data range added to the
+                              # limits when they are extended
+    
+    
+    def __init__(self, t, plots = ['alt', 'vt'], ncols = 2, fps = 10):
         
-        plt.show()
+        for suffix in plots:
+            if len(line_specs[suffix][0]) != 2:
+                raise ValueError(suffix + ': live plots must be 2D')
         
+        self.t = t
+        self.plots = plots
+        self.fps = fps
+        self.shown = 0            # rows drawn so far
+        self.extents = {}         # (axes, 0 or 1) -> range of x or y drawn
         
-    # Downrange vs Time
-    
-    def plot_drt(self):
+        nrows = -(-len(plots) // ncols)
+        ncols = min(ncols, len(plots))
         
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
+        self.fig = plt.figure(figsize = (ncols * t.figsizeX, 
+                                         nrows * t.figsizeY))
+        self.fig.suptitle(t.fname)
         
-        plt.plot(
-            'Time',
-            'Downrange', 
-            data=self.data, 
-            marker= None , color= self.color, lw = self.lw
-            )
+        # per plot: the whole line, drawn on full redraws, and the new
+        # part of the line, drawn on top of the background on every frame
         
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Downrange, km"
-            )
+        self.axes = []
         
-        if self.save:
-            plt.savefig(self.fname + '_drt.png',dpi = 300)
+        for i, suffix in enumerate(plots):
+            
+            columns, axlabels = line_specs[suffix]
             
+            ax = self.fig.add_subplot(nrows, ncols, i + 1)
+            ax.set(xlabel = axlabels[0], ylabel = axlabels[1])
+            
+            line, = ax.plot([], [], color = t.color, lw = t.lw)
+            new, = ax.plot([], [], color = t.color, lw = t.lw,
+                           animated = True)
+            
+            self.axes.append((ax, columns, line, new))
+            
+        self.fig.tight_layout()
+        self.redraw()
         
-        plt.show()
         
-    # Crossrange vs Time
+    # draw the whole figure and save it as the background of the next frames
     
-    def plot_crt(self):
+    def redraw(self):
         
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        plt.plot(
-            'Time',
-            'Crossrange', 
-            data=self.data, 
-            marker= None , color= self.color, lw = self.lw
-            )
+        canvas = self.fig.canvas
+        canvas.draw()
         
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Crossrange, km"
-            )
+        self.background = canvas.copy_from_bbox(self.fig.bbox)
         
-        if self.save:
-            plt.savefig(self.fname + '_crt.png',dpi = 300)
-            
         
-        plt.show()
+    # extend the limits of ax to new points x, y, return True if they
+    # changed. the limits are the range of the data drawn, plus headroom on
+    # the sides where the data grew and a small margin on the others
+    
+    def extend(self, ax, x, y):
         
+        changed = False
         
-    # Velocity vs Time
+        for i, (v, get_lims, set_lims) in enumerate(
+                [(x, ax.get_xlim, ax.set_xlim), (y, ax.get_ylim, ax.set_ylim)]):
+            
+            lo = np.nanmin(v)
+            hi = np.nanmax(v)
+            
+            lims = get_lims()
+            extent = self.extents.get((ax, i))
+            
+            if extent is not None:
+                
+                if lims[0] <= lo and hi <= lims[1]:
+                    continue
+                
+                lo = min(lo, extent[0])
+                hi = max(hi, extent[1])
+                
+            self.extents[(ax, i)] = (lo, hi)
+            
+            r = hi - lo or max(abs(hi), 1.0)
+            
+            set_lims(lo - r * (self.headroom if lo < lims[0] else 0.05),
+                     hi + r * (self.headroom if hi > lims[1] else 0.05))
+            changed = True
+            
+        return changed
     
-    def plot_vt(self):
+    
+    # read the new rows and draw them; returns the number of new rows
+    
+    def update(self):
         
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
+        self.t.follow()
         
-        plt.plot(
-            'Time',
-            'Velocity', 
-            data=self.data, 
-            marker= None , color= self.color, lw = self.lw
-            )
+        n = len(self.t.data)
         
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Earth relative velocity, m/s"
-            )
+        if n <= self.shown:
+            return 0
         
-        if self.save:
-            plt.savefig(self.fname + '_vt.png',dpi = 300)
-            
-        
-        plt.show()
-        
-        
-    # Acceleration vs Time
-    
-    def plot_at(self):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        plt.plot(
-            'Time',
-            'Acceleration', 
-            data=self.data, 
-            marker= None , color= self.color, lw = self.lw
-            )
+        # the new rows and the last row drawn, which joins them to the line
         
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Acceleration, m/s$^2$"
-            )
+        first = max(self.shown - 1, 0)
+        full = False
         
-        if self.save:
-            plt.savefig(self.fname + '_at.png',dpi = 300)
+        for ax, (x, y), line, new in self.axes:
             
-        
-        plt.show()
-        
-    # Acceleration X vs Time
-    
-    def plot_axt(self):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        plt.plot(
-            'Time',
-            'Acceleration X', 
-            data=self.data, 
-            marker= None , color= self.color, lw = self.lw
-            )
-        
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Acceleration X, m/s$^2$"
-            )
-        
-        if self.save:
-            plt.savefig(self.fname + '_axt.png',dpi = 300)
+            data = self.t.derive([x, y])
             
-        
-        plt.show()
-        
-    # Acceleration Y vs Time
-    
-    def plot_ayt(self):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        plt.plot(
-            'Time',
-            'Acceleration Y', 
-            data=self.data, 
-            marker= None , color= self.color, lw = self.lw
-            )
-        
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Acceleration Y, m/s$^2$"
-            )
-        
-        if self.save:
-            plt.savefig(self.fname + '_ayt.png',dpi = 300)
+            xs = data[x].to_numpy()
+            ys = data[y].to_numpy()
             
+            line.set_data(xs, ys)
+            new.set_data(xs[first:], ys[first:])
+            
+            if self.extend(ax, xs[first:], ys[first:]):
+                full = True
+                
+        added = n - self.shown
+        self.shown = n
         
-        plt.show()
-         
-    # Acceleration Z vs Time
-    
-    def plot_azt(self):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        plt.plot(
-            'Time',
-            'Acceleration Z', 
-            data=self.data, 
-            marker= None , color= self.color, lw = self.lw
-            )
+        if full:
+            self.redraw()
+            return added
         
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Acceleration Z, m/s$^2$"
-            )
+        canvas = self.fig.canvas
+        canvas.restore_region(self.background)
         
-        if self.save:
-            plt.savefig(self.fname + '_azt.png',dpi = 300)
+        for ax, columns, line, new in self.axes:
+            ax.draw_artist(new)
             
+        canvas.blit(self.fig.bbox)
         
-        plt.show()
+        # the new parts are now part of the background
         
+        self.background = canvas.copy_from_bbox(self.fig.bbox)
         
-    # Pitch Angle vs Time
+        return added
     
     
-    def plot_pat(self):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        plt.plot(
-            'Time',
-            'Pitch Angle', 
-            data=self.data, 
-            marker= None , color= self.color, lw = self.lw
-            )
+    # refresh the figure fps times per second until it is closed
+    
+    def run(self):
         
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Pitch Angle, deg"
-            )
+        timer = self.fig.canvas.new_timer(interval = 1000 / self.fps)
+        timer.add_callback(self.update)
+        timer.start()
         
-        if self.save:
-            plt.savefig(self.fname + '_pat.png',dpi = 300)
-            
+        self.timer = timer
         
         plt.show()
         
         
-    # Pitch Angle vs Time
-    
-    
-    def plot_hat(self):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        plt.plot(
-            'Time',
-            'Heading Angle', 
-            data=self.data, 
-            marker= None , color= self.color, lw = self.lw
-            )
-        
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Heading Angle, deg"
-            )
         
-        if self.save:
-            plt.savefig(self.fname + '_hat.png',dpi = 300)
+# settings of trajectory t as set on the instance, without its data
+
+def _settings(t):
+    return {k: v for k, v in t.__dict__.items()
+            if k not in ('data', 'on_resize')}
+
+
+# lazily loaded, size bounded mapping of trajectory names to trajectories
+#
+# a trajectory is parsed on first access and kept in a least recently used
+# list bounded by the number of trajectories and/or the bytes of their data.
+# evicted trajectories are parsed again (normally from the binary cache) on
+# the next access; their settings (color, lw, saving, ...) are kept and
+# restored.
+# with a store (see trajectory_store) the data of a trajectory is a view of
+# the memory mapped store instead of a parsed frame.
+
+class trajectory_lru:
+    
+    def __init__(self, fpaths, cache = None, max_trajectories = None,
+                 max_bytes = None, stream = False, store = None):
+        self.fpaths = fpaths      # trajectory name -> file path
+        self.cache = cache
+        self.stream = stream
+        self.store = store
+        self.max_trajectories = max_trajectories
+        self.max_bytes = max_bytes
+        
+        self.loaded = OrderedDict()  # name -> trajectory, least recent first
+        self.sizes = {}
+        self.nbytes = 0
+        self.state = {}              # settings of evicted trajectories
+        
+        
+    def __getitem__(self, fname):
+        
+        if fname in self.loaded:
+            self.loaded.move_to_end(fname)
+            return self.loaded[fname]
+        
+        if self.store is not None and fname in self.store:
+            t = trajectory(self.fpaths[fname], 
+                           data = self.store.frame(fname))
+        else:
+            t = trajectory(self.fpaths[fname], self.cache, self.stream)
             
+        t.__dict__.update(self.state.pop(fname, {}))
         
-        plt.show()
-        
+        self.add(fname, t)
         
-    # Mach vs Time
+        return t
     
     
-    def plot_mt(self):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        plt.plot(
-            'Time',
-            'Mach', 
-            data=self.data, 
-            marker= None , color= self.color, lw = self.lw
-            )
+    def add(self, fname, t):
         
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Mach"
-            )
+        self.loaded[fname] = t
+        self.sizes[fname] = int(t.data.memory_usage().sum())
+        self.nbytes += self.sizes[fname]
         
-        if self.save:
-            plt.savefig(self.fname + '_mt.png',dpi = 300)
-            
+        # derived columns make a loaded trajectory larger
         
-        plt.show()
+        t.on_resize = lambda: self.resized(fname, t)
         
+        self.evict()
         
         
-    # Other plots
-
-
-   # Altitude vs Mach
+    # measure trajectory t of name fname again after its data grew
     
-    
-    def plot_am(self):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        plt.plot(
-            'Mach',
-            'Altitude', 
-            data=self.data, 
-            marker= None , color= self.color, lw = self.lw
-            )
+    def resized(self, fname, t):
         
-        ax.set(
-            xlabel = "Mach",
-            ylabel = "Altitude, km"
-            )
+        if self.loaded.get(fname) is not t:
+            return
         
-        if self.save:
-            plt.savefig(self.fname + '_am.png',dpi = 300)
-            
+        size = int(t.data.memory_usage().sum())
         
-        plt.show()
+        self.nbytes += size - self.sizes[fname]
+        self.sizes[fname] = size
         
-   # Altitude vs Velocity
+        self.evict()
     
     
-    def plot_av(self):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        plt.plot(
-            'Velocity',
-            'Altitude', 
-            data=self.data, 
-            marker= None , color= self.color, lw = self.lw
-            )
-        
-        ax.set(
-            xlabel = "Velocity, m/s",
-            ylabel = "Altitude, km"
-            )
+    # drop least recently used trajectories until the bounds hold again,
+    # always keeping the most recent one
+    
+    def evict(self):
         
-        if self.save:
-            plt.savefig(self.fname + '_av.png',dpi = 300)
+        while len(self.loaded) > 1 and (
+                (self.max_trajectories is not None 
+                 and len(self.loaded) > self.max_trajectories) or
+                (self.max_bytes is not None 
+                 and self.nbytes > self.max_bytes)):
             
+            fname, t = self.loaded.popitem(last = False)
+            self.nbytes -= self.sizes.pop(fname)
+            
+            self.state[fname] = _settings(t)
+            
+            
+    # settings of a trajectory (as set on the instance) without loading it
+    
+    def settings(self, fname):
         
-        plt.show()
-        
+        if fname in self.loaded:
+            return _settings(self.loaded[fname])
         
-    # 3D plots
+        return dict(self.state.get(fname, {}))
     
-    # XYZ
     
-    def plot_xyz(self):
-        
-        #fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        ax = plt.figure().add_subplot(projection='3d')
+    def __setitem__(self, fname, t):
         
-        ax.plot(
-            self.data['X Position'],
-            self.data['Y Position'],
-            self.data['Z Position'],
-            color = self.color,
-            lw = self.lw
-            )
+        self.fpaths[fname] = t.fpath
         
-        ax.set(
-            xlabel = 'X, km',
-            ylabel = 'Y, km',
-            zlabel = 'Z, km'
-            )
-        
-        if self.save:
-            plt.savefig(self.fname + '_xyz.png',dpi = 300)
+        if fname in self.loaded:
+            self.nbytes -= self.sizes.pop(fname)
+            del self.loaded[fname]
             
-
-        
-        plt.show()
-        
+        self.state.pop(fname, None)
         
-    # Downrange, Crossrange, Altitude
+        self.add(fname, t)
         
-    def plot_3D(self):
         
-        #fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        ax = plt.figure().add_subplot(projection='3d')
-        
-        ax.plot(
-            self.data['Downrange'],
-            self.data['Crossrange'],
-            self.data['Altitude'],
-            color = self.color,
-            lw = self.lw
-            )
+    def __delitem__(self, fname):
         
-        ax.set(
-            xlabel = 'Downrange, km',
-            ylabel = 'Crossrange, km',
-            zlabel = 'Altitude, km'
-            )
+        del self.fpaths[fname]
         
-        if self.save:
-            plt.savefig(self.fname + '_3D.png',dpi = 300)
+        if fname in self.loaded:
+            self.nbytes -= self.sizes.pop(fname)
+            del self.loaded[fname]
             
-
+        self.state.pop(fname, None)
         
-        plt.show()
         
+    def __iter__(self):
+        return iter(self.fpaths)
+    
+    def __len__(self):
+        return len(self.fpaths)
+    
+    def __contains__(self, fname):
+        return fname in self.fpaths
+    
+    def keys(self):
+        return self.fpaths.keys()
+    
+    def values(self):
+        return (self[fname] for fname in self.fpaths)
+    
+    def items(self):
+        return ((fname, self[fname]) for fname in self.fpaths)
+    
+    
+    
 # class containing all trajectories in a directory
+#
+# trajectories are loaded lazily on first access to tdict and at most
+# max_trajectories of them / max_bytes of data are kept in memory
+# (lazy = False parses every file up front and keeps all of them).
+# stream = True never loads whole files, only chunks of rows, which is
+# enough for summaries and the end point plots.
+# store = True consolidates the directory into a memory mapped store (see
+# trajectory_store), built on first use and whenever a file changes; the
+# trajectories are then views of the store and cost no parsing. a store
+# object (e.g. a shared_store attached to shared memory) is used as given.
 
 class trajectory_dir:
     
@@ -594,6 +1077,7 @@ class trajectory_dir:
     
     save = False              # save plots to files (don't save by default)
     dpi = 300                 # resolution of figures
+    outdir = ''               # directory of saved figures
     
     # default plot parameters
     
@@ -602,730 +1086,1064 @@ class trajectory_dir:
     figsizeX = 6.4
     figsizeY = 4.8
     
+    decimation = False        # draw only the points visible at the figure's
+                              # pixel resolution (see trajectory_decimate)
     
+    catalog_data = None       # summaries of all files (see catalog())
+    ensemble_data = None      # ensembles computed by ensemble()
+    dispersion_data = None    # impact dispersion (see dispersion())
     
-    def __init__(self, dir1):
-        flist = os.listdir(dir1)
-        
-        i = 0
-
-        for f in flist:
-            if (os.path.splitext(f)[-1] != '.CSV'):
-                del flist[i]
-            i+=1
-            
+    # the combined time plots draw the median and percentile bands of the
+    # ensemble instead of one line per trajectory when envelopes are enabled
+    
+    envelopes = False
+    envelope_bands = [(5, 95), (25, 75)]
+    envelope_points = 1000
+    
+    # combined plots of more than collection_threshold trajectories draw
+    # all of them as one collection with a single legend entry, the line
+    # plots of more than density_threshold trajectories a 2D histogram of
+    # their points (density_bins bins) as an image
+    
+    collection_threshold = 50
+    density_threshold = 1000
+    density_bins = (320, 240)
+    density_cmap = 'viridis'
+    store = None              # memory mapped store of the directory
+    shared = None             # shared memory copy of the data (see share())
+    
+    # default memory bounds of the lazily loaded trajectories
+    
+    max_trajectories = None
+    max_bytes = 2**30
+    
+    
+    
+    def __init__(self, dir1, cache = None, lazy = True,
+                 max_trajectories = None, max_bytes = None, stream = False,
+                 store = False):
+        self.dir = dir1
+        flist = [f for f in os.listdir(dir1)
+                 if os.path.splitext(f)[-1] == '.CSV']
             
         flist.sort()
         
         self.flist = flist
         
+        fpaths = OrderedDict()
         
         for f in flist:
             fname = os.path.splitext(f)[0]
-            self.tdict[fname] = trajectory(dir1 + f)
+            fpaths[fname] = dir1 + f
             
-     
-    
-    # plot all independent plots for each trajectory
-    
-    def plot_all_separate(self, save = False):
+        # streamed trajectories read their files in chunks, a store holds
+        # all of the data
         
+        if store and stream:
+            raise ValueError('a directory is either streamed or loaded from '
+                             'a store')
         
-        if save == True:
-            for fname in self.tdict:
-                self.tdict[fname].enable_saving()
-                
-        if save == False:
-            for fname in self.tdict:
-                self.tdict[fname].disable_saving()
-            
-        
-        for fname in self.tdict:
-            
-            print("Trajectory: " + fname)
+        if store is True:
+            self.store = load_store(dir1, flist)
+        elif store:
+            self.store = store
             
-            self.tdict[fname].plot_xt()
-            self.tdict[fname].plot_yt()
-            self.tdict[fname].plot_zt()
-            
-            self.tdict[fname].plot_grt()
-            self.tdict[fname].plot_alt()
-       
-            
-            self.tdict[fname].plot_drt()
-            self.tdict[fname].plot_crt()
-            
-            self.tdict[fname].plot_vt()
-
-            self.tdict[fname].plot_at()
-            self.tdict[fname].plot_axt()
-            self.tdict[fname].plot_ayt()
-            self.tdict[fname].plot_azt()
-
-            self.tdict[fname].plot_pat()
-            self.tdict[fname].plot_hat()
-
-            self.tdict[fname].plot_mt()
-            
-            self.tdict[fname].plot_am()
-            self.tdict[fname].plot_av()
-
-            self.tdict[fname].plot_xyz()
-            self.tdict[fname].plot_3D()
+        if not lazy:
+            if self.store is not None:
+                self.tdict = {fname: trajectory(fpaths[fname], 
+                                                data = self.store.frame(fname))
+                              for fname in fpaths}
+            else:
+                self.tdict = {fname: trajectory(fpaths[fname], cache, stream)
+                              for fname in fpaths}
+            return
+        
+        if max_trajectories is not None:
+            self.max_trajectories = max_trajectories
             
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
             
+        self.tdict = trajectory_lru(fpaths, cache, 
+                                    self.max_trajectories, self.max_bytes,
+                                    stream, self.store)
             
+     
     
-            
-            
-    def plot_combined_xt(self, save = False):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Time',
-                'X Position', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
+    def enable_decimation(self):
+        self.decimation = True
         
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "X Position, km"
-            )
-        
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
-                       
-        if save:
-            plt.savefig('combined_xt.png',dpi = 300)
+    def disable_decimation(self):
+        self.decimation = False
         
-        plt.show()
+    def enable_envelopes(self):
+        self.envelopes = True
         
+    def disable_envelopes(self):
+        self.envelopes = False
         
-                
-    def plot_combined_yt(self, save = False):
         
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
+    # summaries (time window, apogee, max Mach, final position, ...) of all
+    # trajectories, from the catalog kept next to the data; only files that
+    # changed since the last run are read
+    
+    def catalog(self):
         
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Time',
-                'Y Position', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
+        if self.catalog_data is None:
+            summaries = read_catalog(self.dir, self.flist)
+            
+            self.catalog_data = {os.path.splitext(f)[0]: summaries[f]
+                                 for f in self.flist}
+            
+        return self.catalog_data
+    
+    
+    # summary of one trajectory, from the catalog when possible
+    
+    def summary(self, fname):
         
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Y Position, km"
-            )
+        catalog = self.catalog()
         
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
+        if fname in catalog:
+            return catalog[fname]
         
-        if save:
-            plt.savefig('combined_yt.png',dpi = 300)
+        return self.tdict[fname].summary()
+    
+    
+    # dispersion of the impact points (MPI, CEP, error ellipses, outliers,
+    # see trajectory_dispersion), from the final points in the catalog
+    
+    def dispersion(self):
         
-        plt.show()
+        if self.dispersion_data is None:
+            self.dispersion_data = read_dispersion(self.dir, self.catalog())
+            
+        return self.dispersion_data
+    
+    
+    # catalog of all trajectories as a table, one row per trajectory
+    
+    def summary_table(self):
+        return pd.DataFrame.from_dict(self.catalog(), orient = 'index')
         
-                    
-    def plot_combined_zt(self, save = False):
         
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
+    # data of trajectory fname to plot the given columns, decimated to the
+    # pixel resolution of axes ax (or of a figure figwidth inches wide) when
+    # decimation is enabled
+    
+    def plot_data(self, fname, columns, figwidth = None, ax = None):
         
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Time',
-                'Z Position', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
+        with stage('transform', fname):
+            
+            data = self.tdict[fname].derive(columns)
+            
+            if not self.decimation:
+                return data
+            
+            return decimate(data, columns, figwidth, self.dpi, ax)
         
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Z Position, km"
-            )
         
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
+    # the given columns of all trajectories resampled onto a common grid of
+    # the time or of the flight fraction (see trajectory_ensemble), computed
+    # once per set of arguments
+    
+    def ensemble(self, columns, points = None, fraction = False):
         
-        if save:
-            plt.savefig('combined_zt.png',dpi = 300)
+        key = (tuple(columns), points, fraction)
         
-        plt.show()
+        if self.ensemble_data is None:
+            self.ensemble_data = {}
         
+        if key not in self.ensemble_data:
+            self.ensemble_data[key] = align(
+                self.tdict, lambda fname: self.tdict[fname].derive(columns),
+                columns, points, fraction)
+            
+        return self.ensemble_data[key]
+    
+    
+    # publish the data of all trajectories into shared memory once; batch
+    # runs with workers then attach their workers to it instead of loading
+    # the files in every worker. close the returned shared_store (or use it
+    # in a with statement) to free the memory
+    
+    def share(self):
         
-    def plot_combined_zt(self, save = False):
+        def data(fname):
+            
+            t = self.tdict[fname]
+            
+            if t.stream:
+                raise ValueError(fname + ': streamed trajectories have no '
+                                 'data to share')
+            return t.data
         
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Time',
-                'Z Position', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
-        
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Z Position, km"
-            )
-        
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
-        
-        if save:
-            plt.savefig('combined_zt.png',dpi = 300)
-        
-        plt.show()
-        
-        
-    def plot_combined_grt(self, save = False):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Time',
-                'Ground Range', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
-        
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Ground Range, km"
-            )
-        
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
-        
-        if save:
-            plt.savefig('combined_grt.png',dpi = 300)
-        
-        plt.show()
-        
-        
-        
-    def plot_combined_alt(self, save = False):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Time',
-                'Altitude', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
-        
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Altitude, km"
-            )
-        
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
-        
-        if save:
-            plt.savefig('combined_alt.png',dpi = 300)
-        
-        plt.show()
-        
-        
-    def plot_combined_drt(self, save = False):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Time',
-                'Downrange', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
-        
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Downrange, km"
-            )
-        
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
-        
-        if save:
-            plt.savefig('combined_drt.png',dpi = 300)
-        
-        plt.show()
-        
-        
-    def plot_combined_crt(self, save = False):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Time',
-                'Crossrange', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
-        
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Crossrange, km"
-            )
-        
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
-        
-        if save:
-            plt.savefig('combined_crt.png',dpi = 300)
-        
-        plt.show()
-        
-    def plot_combined_vt(self, save = False):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Time',
-                'Velocity', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
-        
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Velocity, m/s"
-            )
-        
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
-        
-        if save:
-            plt.savefig('combined_vt.png',dpi = 300)
-        
-        plt.show()
-        
-        
-    def plot_combined_at(self, save = False):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Time',
-                'Acceleration', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
-        
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Acceleration, m/s$^2$"
-            )
-        
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
-        
-        if save:
-            plt.savefig('combined_at.png',dpi = 300)
+        if self.shared is None or self.shared.closed:
+            self.shared = share_frames(self.tdict, data)
+            
+        return self.shared
+    
+    
+    # how workers of batch runs get the data: the name of a shared memory
+    # segment, True to map the store of the directory or False to load the
+    # files
+    
+    def worker_store(self):
         
-        plt.show()
+        if self.shared is not None and not self.shared.closed:
+            return self.shared.name
         
+        if isinstance(self.store, shared_store):
+            return self.store.name
         
+        return self.store is not None
+    
+    
+    # build manifest of the output directory (None unless incremental)
+    
+    def manifest(self, incremental):
         
-    def plot_combined_axt(self, save = False):
+        if not incremental:
+            return None
         
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
+        return os.path.join(self.outdir, '.plot_manifest.json')
+    
+    
+    # draw the given plot methods (by default all plots of the default
+    # batches, see plot_registry): the separate plots for each trajectory,
+    # then the combined plots of the directory
+    # with workers given, all (trajectory, plot) and combined jobs are run
+    # as one batch: spread over a process pool for workers > 1, in this
+    # process for workers = 1. failed jobs are reported and returned
+    # instead of stopping the batch. incremental runs (skipping the plots
+    # that are up to date, see manifest) are always such a batch, in this
+    # process unless workers are given.
+    # reuse = True redraws one figure per separate plot kind instead of
+    # creating and showing a new one for every plot (always done in
+    # batches)
+    # with archive given (a .zip or .tar path), all images are saved into
+    # that archive instead of outdir (see trajectory_archive); the archive
+    # is written anew, so incremental is ignored
+    
+    def plot_all(self, plots = None, save = False, workers = None, 
+                 reuse = False, incremental = False, archive = None):
         
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Time',
-                'Acceleration X', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
+        if archive is not None:
+            with trajectory_archive.open_archive(archive):
+                return self.plot_all(plots, save = True, workers = workers,
+                                     reuse = reuse)
+                
+        if plots is None:
+            plots = separate_plots + combined_plots
+            
+        separate = [p for p in plots if _family(p) == 'separate']
+        combined = [p for p in plots if _family(p) == 'combined']
         
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Acceleration X, m/s$^2$"
-            )
+        if workers is not None or incremental:
+            
+            jobs = (self.separate_jobs(separate, save, incremental)
+                    + self.combined_jobs(combined, save, incremental))
+            
+            # only saved images are recorded as built
+            
+            return _run_jobs(jobs, workers or 1, 
+                             self.manifest(incremental and save))
         
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
         
-        if save:
-            plt.savefig('combined_axt.png',dpi = 300)
+        for fname in (self.tdict if separate else []):
+            
+            print("Trajectory: " + fname)
+            
+            t = self.tdict[fname]
+            t.dpi = self.dpi
+            t.outdir = self.outdir
+            
+            # the directory's decimation applies for this run only, as in
+            # the batch jobs (see separate_jobs)
+            
+            decimated = t.decimation
+            
+            if self.decimation:
+                t.enable_decimation()
+            
+            if save == True:
+                t.enable_saving()
+            else:
+                t.disable_saving()
+                
+            if reuse:
+                t.enable_figure_reuse()
+            else:
+                t.disable_figure_reuse()
+            
+            try:
+                for plot in separate:
+                    getattr(t, plot)()
+            finally:
+                t.decimation = decimated
+                
+        if reuse:
+            figures.close()
+            
+        for plot in combined:
+            with stage('draw', 'combined', plot):
+                getattr(self, plot)(save = save)
+                
+        # images still being written in the background
         
-        plt.show()
+        failed = []
         
-    def plot_combined_ayt(self, save = False):
+        for path, error in trajectory_writer.flush():
+            print("Failed: " + path + "\n" + error)
+            failed.append((path, 'write', error))
+            
+        return failed
+    
+    
+    # batch jobs of the given separate plot methods for every trajectory
+    
+    def separate_jobs(self, plots, save, incremental):
         
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
+        store = self.worker_store()
         
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Time',
-                'Acceleration Y', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
+        jobs = []
         
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Acceleration Y, m/s$^2$"
-            )
+        for fname in (self.tdict if plots else []):
+            
+            if isinstance(self.tdict, trajectory_lru):
+                settings = self.tdict.settings(fname)
+                fpath = self.tdict.fpaths[fname]
+            else:
+                settings = self.tdict[fname].__dict__
+                fpath = self.tdict[fname].fpath
+                
+            style = {}
+            
+            for key in ['color', 'lw', 'figsizeX', 'figsizeY']:
+                style[key] = settings.get(key, getattr(trajectory, key))
+                
+            style['dpi'] = self.dpi
+            style['outdir'] = self.outdir
+            style['decimation'] = (self.decimation or 
+                                   settings.get('decimation', False))
+            
+            for plot in plots:
+                
+                output = os.path.join(self.outdir, fname + '_' 
+                                      + plot[len('plot_'):] + '.png')
+                
+                if incremental:
+                    key = _build_key(plot, _plot_spec(plot), style,
+                                     [file_hash(fpath)])
+                else:
+                    key = None
+                    
+                jobs.append((fname, plot, 
+                             (_render_separate, fpath, plot, style, save,
+                              store),
+                             [output], key))
+                
+        return jobs
+    
+    
+    # batch jobs of the given combined plot methods
+    
+    def combined_jobs(self, plots, save, incremental):
+        
+        if not plots:
+            return []
+        
+        style = {'lw': self.lw,
+                 'figsizeX': self.figsizeX,
+                 'figsizeY': self.figsizeY,
+                 'dpi': self.dpi,
+                 'outdir': self.outdir,
+                 'decimation': self.decimation,
+                 'envelopes': self.envelopes,
+                 'envelope_bands': self.envelope_bands,
+                 'envelope_points': self.envelope_points,
+                 'collection_threshold': self.collection_threshold,
+                 'density_threshold': self.density_threshold,
+                 'density_bins': self.density_bins,
+                 'density_cmap': self.density_cmap}
+        
+        if incremental:
+            sources = [file_hash(self.dir + f) for f in self.flist]
+            palette = [list(c) for c in sns.color_palette()]
+            
+        store = self.worker_store()
         
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
+        jobs = []
         
-        if save:
-            plt.savefig('combined_ayt.png',dpi = 300)
+        for plot in plots:
+            
+            output = os.path.join(self.outdir, combined_outputs[plot])
+            
+            if incremental:
+                key = _build_key(plot, [_plot_spec(plot), palette], style,
+                                 sources)
+            else:
+                key = None
+                
+            jobs.append(('combined', plot,
+                         (_render_combined, self.dir, plot, style, save,
+                          store),
+                         [output], key))
+            
+        return jobs
+    
+    
+    # plot all independent plots for each trajectory (or only the plot
+    # methods listed in plots), see plot_all
+    
+    def plot_all_separate(self, save = False, workers = None, reuse = False,
+                          plots = None, incremental = False, archive = None):
         
-        plt.show()
+        if plots is None:
+            plots = separate_plots
+            
+        return self.plot_all(plots, save = save, workers = workers,
+                             reuse = reuse, incremental = incremental,
+                             archive = archive)
+            
+            
+    # one dashboard figure per trajectory instead of the separate plots
+    
+    def plot_all_dashboards(self, save = False, workers = None,
+                            incremental = False, archive = None):
+        return self.plot_all_separate(save = save, workers = workers,
+                                      plots = ['plot_dashboard'],
+                                      incremental = incremental,
+                                      archive = archive)
+            
+            
+    # plot all combined plots for the directory (or only the plot methods
+    # listed in plots), see plot_all
+    
+    def plot_all_combined(self, save = False, workers = None, plots = None,
+                          incremental = False, archive = None):
         
+        if plots is None:
+            plots = combined_plots
+            
+        return self.plot_all(plots, save = save, workers = workers,
+                             incremental = incremental, archive = archive)
+    
+    
+    # save a combined figure as outdir/name, plot (by default the name
+    # without extension) in the stage records and archives
+    
+    def savefig(self, fig, name, plot = None):
         
-    def plot_combined_azt(self, save = False):
+        if plot is None:
+            plot = os.path.splitext(name)[0]
+            
+        savefig(fig, os.path.join(self.outdir, name), self.dpi, 'combined',
+                plot)
+            
+            
+    # draw y against x for every trajectory (see collection_threshold and
+    # density_threshold), or the envelope of y for time plots with
+    # envelopes enabled, and add the legend
+    
+    def plot_lines(self, ax, x, y):
         
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
+        n = len(self.tdict)
         
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Time',
-                'Acceleration Z', 
-                data=self.tdict[fname].data, 
+        if self.envelopes and x == 'Time':
+            self.plot_envelope(ax, y)
+            
+        elif n > self.density_threshold:
+            self.plot_density(ax, x, y)
+            return
+            
+        elif n > self.collection_threshold:
+            
+            lines = LineCollection(
+                [self.plot_data(fname, [x, y], ax = ax)[[x, y]]
+                 .to_numpy() for fname in self.tdict],
+                colors = line_colors(n),
                 lw = self.lw,
-                label = fname
+                label = str(n) + ' trajectories'
                 )
-        
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Acceleration Z, m/s$^2$"
-            )
-        
+            
+            ax.add_collection(lines)
+            ax.autoscale_view()
+            
+        else:
+            for fname in self.tdict:
+                
+                ax.plot(
+                    x,
+                    y,
+                    data=self.plot_data(fname, [x, y], ax = ax),
+                    lw = self.lw,
+                    label = fname
+                    )
+                
         ax.legend(bbox_to_anchor=(1,1), loc="upper left")
         
-        if save:
-            plt.savefig('combined_azt.png',dpi = 300)
-        
-        plt.show()
-        
-        
-    def plot_combined_pat(self, save = False):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Time',
-                'Pitch Angle', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
         
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Pitch Angle, deg"
-            )
+    # 3D lines of every trajectory, as one collection for more than
+    # collection_threshold trajectories
+    
+    def plot_lines_3D(self, ax, x, y, z):
         
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
+        n = len(self.tdict)
         
-        if save:
-            plt.savefig('combined_pat.png',dpi = 300)
+        if n <= self.collection_threshold:
+            
+            for fname in self.tdict:
+                
+                data = self.plot_data(fname, [x, y, z], ax = ax)
+                
+                ax.plot(
+                    data[x],
+                    data[y],
+                    data[z],
+                    lw = self.lw
+                    )
+            return
         
-        plt.show()
+        lines = [self.plot_data(fname, [x, y, z], ax = ax)[[x, y, z]]
+                 .to_numpy()
+                 for fname in self.tdict]
         
+        ax.add_collection3d(Line3DCollection(lines, colors = line_colors(n),
+                                             lw = self.lw))
         
-    def plot_combined_hat(self, save = False):
+        points = np.concatenate(lines)
+        ax.auto_scale_xyz(points[:, 0], points[:, 1], points[:, 2], 
+                          had_data = False)
         
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
         
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Time',
-                'Heading Angle', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
+    # points of the given summary columns (e.g. the final position) of every
+    # trajectory, as a single scatter for more than collection_threshold
+    # trajectories, and the legend
+    
+    def plot_points(self, ax, columns):
         
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Heading Angle, deg"
-            )
+        n = len(self.tdict)
         
+        if n <= self.collection_threshold:
+            
+            for fname in self.tdict:
+                
+                end = self.summary(fname)
+                
+                ax.scatter(
+                    *[end[c] for c in columns],
+                    marker = 'o',
+                    label = fname
+                    )
+        else:
+            points = np.array([[self.summary(fname)[c] for c in columns]
+                               for fname in self.tdict])
+            
+            ax.scatter(*points.T, c = line_colors(n), marker = 'o',
+                       label = str(n) + ' trajectories')
+            
         ax.legend(bbox_to_anchor=(1,1), loc="upper left")
         
-        if save:
-            plt.savefig('combined_pat.png',dpi = 300)
         
-        plt.show()
+    # image of the number of points of all trajectories in the bins of a
+    # 2D histogram of y against x, with a colorbar instead of a legend
+    
+    def plot_density(self, ax, x, y):
         
+        # the range of the bins, then the counts, one trajectory at a time
         
-    def plot_combined_mt(self, save = False):
+        lo = np.full(2, np.inf)
+        hi = np.full(2, -np.inf)
         
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
+        for fname in self.tdict:
+            
+            points = self.tdict[fname].derive([x, y])[[x, y]].to_numpy()
+            
+            if len(points):
+                lo = np.fmin(lo, np.nanmin(points, axis = 0))
+                hi = np.fmax(hi, np.nanmax(points, axis = 0))
+                
+        hi = np.where(hi > lo, hi, lo + 1)
+        bounds = [(lo[0], hi[0]), (lo[1], hi[1])]
         
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Time',
-                'Mach', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
+        counts = np.zeros(self.density_bins)
         
-        ax.set(
-            xlabel = "Time, s",
-            ylabel = "Mach"
-            )
+        for fname in self.tdict:
+            
+            points = self.tdict[fname].derive([x, y])[[x, y]].to_numpy()
+            
+            counts += np.histogram2d(points[:, 0], points[:, 1], 
+                                     bins = self.density_bins,
+                                     range = bounds)[0]
+            
+        image = ax.imshow(np.ma.masked_equal(counts.T, 0), origin = 'lower',
+                          extent = (lo[0], hi[0], lo[1], hi[1]),
+                          aspect = 'auto', interpolation = 'nearest',
+                          norm = LogNorm(), cmap = self.density_cmap)
         
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
+        ax.figure.colorbar(image, ax = ax, 
+                           label = 'Points of ' + str(len(self.tdict)) 
+                                   + ' trajectories')
         
-        if save:
-            plt.savefig('combined_mt.png',dpi = 300)
         
-        plt.show()
+    # median of y over the ensemble against time, with shaded bands between
+    # the percentiles of envelope_bands
+    
+    def plot_envelope(self, ax, y):
         
+        e = self.ensemble([y], self.envelope_points)
         
-    def plot_combined_am(self, save = False):
+        median, = ax.plot(e.grid, e.percentiles(y, 50), lw = self.lw,
+                          label = 'median')
         
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
+        for i, (lo, hi) in enumerate(self.envelope_bands):
+            
+            band = e.percentiles(y, [lo, hi])
+            
+            ax.fill_between(e.grid, band[0], band[1], 
+                            color = median.get_color(), 
+                            alpha = 0.2 + 0.2 * i, lw = 0,
+                            label = '%g-%g %%' % (lo, hi))
+            
+            
+    # draw the combined plot with the given suffix (see plot_registry); the
+    # plot methods (plot_combined_xt, ...) call this
+    
+    def plot_combined(self, suffix, save = False):
         
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Mach',
-                'Altitude', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
+        s = plot_registry['plot_combined_' + suffix]
         
-        ax.set(
-            xlabel = "Mach",
-            ylabel = "Altitude, km"
-            )
+        # 2D lines and the dispersion have the size of the separate plots,
+        # 3D plots and points the default size
         
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
+        if len(s.columns) == 3:
+            ax = plt.figure().add_subplot(projection='3d')
+        elif s.kind == 'points':
+            ax = plt.figure().add_subplot()
+        else:
+            fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
+            
+        if s.kind == 'points':
+            self.plot_points(ax, list(s.columns))
+        elif s.kind == 'dispersion':
+            self.plot_dispersion(ax)
+        elif len(s.columns) == 3:
+            self.plot_lines_3D(ax, *s.columns)
+        else:
+            self.plot_lines(ax, *s.columns)
+            
+        ax.set(xlabel = s.labels[0], ylabel = s.labels[1])
         
+        if len(s.columns) == 3:
+            ax.set(zlabel = s.labels[2])
+            
         if save:
-            plt.savefig('combined_am.png',dpi = 300)
-        
-        plt.show()
+            self.savefig(ax.figure, s.output, s.suffix)
+            
+        show(ax.figure)
         
         
+    # impact points with the mean point of impact, the CEP circle and the
+    # error ellipses; outliers are marked with crosses
     
+    def plot_dispersion(self, ax):
         
-    def plot_combined_av(self, save = False):
-        
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Velocity',
-                'Altitude', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
-        
-        ax.set(
-            xlabel = "Velocity, m/s",
-            ylabel = "Altitude, km"
-            )
-        
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
-        
-        if save:
-            plt.savefig('combined_av.png',dpi = 300)
+        d = self.dispersion()
+        catalog = self.catalog()
+        outliers = set(d.get('Outliers', []))
         
-        plt.show()
+        points = np.array([[catalog[f].get('Final Downrange', np.nan),
+                            catalog[f].get('Final Crossrange', np.nan)]
+                           for f in catalog]).reshape(-1, 2)
         
+        outlier = np.array([f in outliers for f in catalog], dtype = bool)
         
-    def plot_combined_agr(self, save = False):
+        ax.scatter(points[~outlier, 0], points[~outlier, 1], marker = 'o',
+                   s = 20, label = 'impact points')
         
-        fig, ax = plt.subplots(figsize = (self.figsizeX,self.figsizeY))
-        
-        for fname in self.tdict: 
-                   
-            plt.plot(
-                'Ground Range',
-                'Altitude', 
-                data=self.tdict[fname].data, 
-                lw = self.lw,
-                label = fname
-                )
+        if outlier.any():
+            ax.scatter(points[outlier, 0], points[outlier, 1], marker = 'x',
+                       color = 'red', label = 'outliers')
         
-        ax.set(
-            xlabel = "Ground Range, km",
-            ylabel = "Altitude, km"
-            )
+        if d['N'] > 0:
+            
+            mpi = (d['MPI Downrange'], d['MPI Crossrange'])
+            
+            ax.plot(*mpi, marker = '+', ms = 15, mew = 3, color = 'black',
+                    ls = 'none', label = 'MPI')
+            
+            ax.add_patch(Circle(mpi, d['CEP'], fill = False, lw = 2,
+                                ls = '--', color = 'black', 
+                                label = 'CEP %.3g km' % d['CEP']))
+            
+            for name in d:
+                
+                if not name.startswith('Ellipse'):
+                    continue
+                
+                e = d[name]
+                
+                ax.add_patch(Ellipse(mpi, 2 * e['Semi-major'], 
+                                     2 * e['Semi-minor'], 
+                                     angle = e['Angle'], fill = False, 
+                                     lw = 2, color = line_colors(2)[1], 
+                                     alpha = 0.5 + 0.5 * (name[8:] == '50%'),
+                                     label = name[8:] + ' ellipse'))
+                
+        # equal scales, so that the CEP circle is round
         
+        ax.set_aspect('equal', adjustable = 'datalim')
+        ax.autoscale_view()
         ax.legend(bbox_to_anchor=(1,1), loc="upper left")
-        
-        if save:
-            plt.savefig('combined_agr.png',dpi = 300)
-        
-        plt.show()
-        
-        
-        
-        
-    # 3D plots
+
+
+
+# plot methods of the registry: trajectory.plot_<suffix>() and
+# trajectory_dir.plot_combined_<suffix>(save = False)
+
+def _plot_method(cls, entry):
     
-    def plot_combined_xyz(self, save = False):
+    if entry.family == 'separate':
+        def plot(self):
+            self.plot_spec(entry.suffix)
+    else:
+        def plot(self, save = False):
+            self.plot_combined(entry.suffix, save = save)
             
-        ax = plt.figure().add_subplot(projection='3d')
-        
+    plot.__name__ = entry.name
+    plot.__qualname__ = cls.__name__ + '.' + entry.name
+    
+    setattr(cls, entry.name, plot)
+
+
+for entry in plot_registry.values():
+    _plot_method(trajectory if entry.family == 'separate' else trajectory_dir,
+                 entry)
+    
+del entry
+
+
+
+# parallel rendering
+#
+# every job is a (name, plot, task) tuple where task is a module level
+# function and its arguments, so that it can be sent to a worker process.
+# worker processes render with the non-interactive Agg backend, never show
+# figures, keep the last few trajectories they have parsed and close each
+# figure after saving. jobs run in the calling process (workers = 1) keep
+# the trajectories for the length of their batch only.
+
+_worker_cache = OrderedDict()
+_worker_cache_size = 4
+_in_worker = False
+
+
+def _worker_init(palette, profiling, writing, archiving):
+    global show_plots, _in_worker
+    
+    plt.switch_backend('Agg')
+    sns.set_palette(palette)
+    show_plots = False
+    _in_worker = True
+    
+    trajectory_profile.settings(profiling)
+    trajectory_writer.settings(writing)
+    
+    # the archive of the batch is written by the parent process
+    
+    if archiving:
+        trajectory_archive.target = trajectory_archive.collector()
+    else:
+        trajectory_archive.target = None
+    
+    
+# end of a job run in a worker process: wait for its images to be written
+# (a failed write fails the job) and return its stage records (see
+# trajectory_profile) and archived images with the result as a dict; the
+# profiles of the worker are dumped after every job, as the worker may be
+# stopped at any time
+
+def _worker_result():
+    
+    if not _in_worker:
+        return None
+    
+    failed = trajectory_writer.flush()
+    
+    if failed:
+        raise OSError('\n'.join(path + ': ' + error 
+                                for path, error in failed))
+    
+    result = {'records': [], 'images': []}
+    
+    if trajectory_profile.enabled:
+        trajectory_profile.dump_profiles(os.getpid())
+        result['records'] = trajectory_profile.collect()
         
-        for fname in self.tdict: 
+    if trajectory_archive.target is not None:
+        result['images'] = trajectory_archive.target.take()
         
-            ax.plot(
-                self.tdict[fname].data['X Position'],
-                self.tdict[fname].data['Y Position'],
-                self.tdict[fname].data['Z Position'],
-                lw = self.lw
-                )
+    return result
+    
+    
+def _clear_worker_cache():
+    
+    # unmap the shared memory segments attached to by the jobs (but not
+    # the ones published by this process, see attach_store)
+    
+    for value in _worker_cache.values():
+        if (isinstance(value, trajectory_dir) and 
+                isinstance(value.store, shared_store) and 
+                not value.store.owner):
+            value.store.close()
             
-        ax.set(
-            xlabel = 'X, km',
-            ylabel = 'Y, km',
-            zlabel = 'Z, km'
-            )
+    _worker_cache.clear()
+    
+    
+def _cached(key, load):
+    
+    if key in _worker_cache:
+        _worker_cache.move_to_end(key)
+    else:
+        _worker_cache[key] = load(key)
         
-        if save:
-            plt.savefig('combined_xyz.png',dpi = 300)
+        if len(_worker_cache) > _worker_cache_size:
+            _worker_cache.popitem(last = False)
             
+    return _worker_cache[key]
+    
+    
+# trajectory_dir of dir1 in a worker; store is the name of a shared memory
+# segment to attach to, True to map the store of the directory or False
+# (see trajectory_dir.worker_store)
 
+def _worker_dir(dir1, store):
+    
+    def load(key):
         
-        plt.show()
-        
-    def plot_combined_3D(self, save = False):
-            
-        ax = plt.figure().add_subplot(projection='3d')
-        
-        
-        for fname in self.tdict: 
+        if isinstance(store, str):
+            return trajectory_dir(dir1, store = attach_store(store))
         
-            ax.plot(
-                self.tdict[fname].data['Downrange'],
-                self.tdict[fname].data['Crossrange'],
-                self.tdict[fname].data['Altitude'],
-                lw = self.lw
-                )
-            
-        ax.set(
-            xlabel = 'Downrange, km',
-            ylabel = 'Crossrange, km',
-            zlabel = 'Altitude, km'
-            )
+        return trajectory_dir(dir1, store = store)
+    
+    return _cached((dir1, store), load)
+    
+    
+# trajectories of a directory with a store or shared data are views of it,
+# mapped once per worker
+
+def _render_separate(fpath, plot, style, save, store = False):
+    
+    if not store:
+        t = _cached(fpath, trajectory)
+    else:
+        bn = os.path.basename(fpath)
+        tdir = _worker_dir(fpath[:len(fpath) - len(bn)], store)
+        t = tdir.tdict[os.path.splitext(bn)[0]]
+    
+    for key in style:
+        setattr(t, key, style[key])
+    
+    t.save = save
+    t.reuse_figures = True
+    
+    getattr(t, plot)()
+    
+    return _worker_result()
         
-        if save:
-            plt.savefig('combined_3D.png',dpi = 300)
-            
         
+def _render_combined(dir1, plot, style, save, store = False):
+    
+    tdir = _worker_dir(dir1, store)
+    
+    for key in style:
+        setattr(tdir, key, style[key])
         
+    # close only the figures of this job: with workers = 1 it runs in the
+    # caller's process, next to the caller's own figures
+    
+    before = set(plt.get_fignums())
+    
+    try:
+        with stage('draw', 'combined', plot):
+            getattr(tdir, plot)(save = save)
+    finally:
+        for num in set(plt.get_fignums()) - before:
+            plt.close(num)
         
-        plt.show()
+    return _worker_result()
         
         
-    def plot_combined_end_2D(self, save = False):
+# incremental builds
+#
+# the build manifest is a JSON file mapping "<name>/<plot>" jobs to the key
+# of their last successful build and its output files. the key is a hash
+# of the plot, its spec, the style settings and the hashes of the source
+# CSV files; a job whose key is unchanged and whose outputs all exist is
+# skipped.
+
+manifest_version = 1
+
+
+# family of a plot method, 'separate' or 'combined' (see plot_registry)
+
+def _family(plot):
+    
+    if plot == 'plot_dashboard':
+        return 'separate'
+    
+    if plot not in plot_registry:
+        raise ValueError('unknown plot: ' + plot)
+    
+    return plot_registry[plot].family
+
+
+# columns and labels drawn by a plot method (and kind and output file of
+# the combined plots)
+
+def _plot_spec(plot):
+    
+    if plot == 'plot_dashboard':
+        return [line_specs[p[len('plot_'):]] for p in separate_plots]
+    
+    if _family(plot) == 'combined':
+        s = plot_registry[plot]
+        return [s.columns, s.labels, s.kind, s.output]
+    
+    return line_specs.get(plot[len('plot_'):])
+
+
+def _build_key(plot, spec, style, sources):
+    
+    key = json.dumps([manifest_version, plot, spec, style, sources], 
+                     sort_keys = True)
+    
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _read_manifest(path):
+    
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+    
+    
+def _write_manifest(path, manifest):
+    write_atomic(path, lambda fh: json.dump(manifest, fh, indent = 1,
+                                            sort_keys = True))
+    
+    
+# run jobs on a pool of workers (or in this process for workers = 1) and
+# return the list of failed jobs as (name, plot, error) tuples, in the order
+# the jobs were given (jobs whose image failed to be written in the
+# background last).
+# every job is a (name, plot, task, outputs, key) tuple; with a manifest
+# path, jobs whose key and outputs are up to date are skipped
+
+def _write_errors(jobs):
+    
+    outputs = {}
+    
+    for name, plot, task, files, key in jobs:
+        for f in files:
+            outputs[os.path.abspath(f)] = (name, plot)
             
-        ax = plt.figure().add_subplot()
-        
+    return [outputs.get(os.path.abspath(path), (path, 'write')) + (error,)
+            for path, error in trajectory_writer.flush()]
+
+
+def _run_jobs(jobs, workers, manifest = None):
+    
+    failed = []
+    
+    if manifest is not None:
         
-        for fname in self.tdict: 
+        built = _read_manifest(manifest)
+        todo = []
         
-            ax.scatter(
-                self.tdict[fname].data['Downrange'].iloc[-1],
-                self.tdict[fname].data['Crossrange'].iloc[-1],
-                marker = 'o',
-                label = fname
-                )
+        for job in jobs:
+            name, plot, task, outputs, key = job
+            entry = built.get(name + '/' + plot)
             
-        ax.set(
-            xlabel = 'Downrange, km',
-            ylabel = 'Crossrange, km'
-            )
-        
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
-
-        
-        if save:
-            plt.savefig('combined_end_2D.png',dpi = 300)
+            if (entry is not None and entry['key'] == key and 
+                    all(os.path.exists(f) for f in outputs)):
+                continue
             
+            todo.append(job)
+            
+        print("Skipped " + str(len(jobs) - len(todo)) + " up to date plots")
         
+        jobs = todo
+    
+    def run(results):
+        
+        for (name, plot, task, outputs, key), result in zip(jobs, results):
+            try:
+                output = result()
+            except Exception:
+                error = traceback.format_exc()
+                print("Failed: " + name + " " + plot + "\n" + error)
+                failed.append((name, plot, error))
+            else:
+                if output:
+                    trajectory_profile.records.extend(output['records'])
+                    
+                    for image in output['images']:
+                        trajectory_archive.target.add(*image)
+                    
+                if manifest is not None:
+                    built[name + '/' + plot] = {'key': key, 
+                                                'outputs': outputs}
+    
+    if workers <= 1:
         
+        # the trajectories cached by earlier batches in this process may
+        # have changed on disk since
         
-        plt.show()
-        
+        _clear_worker_cache()
         
-    def plot_combined_end_xyz(self, save = False):
+        try:
+            run(lambda task = task: task[0](*task[1:]) 
+                for name, plot, task, outputs, key in jobs)
+        finally:
+            # the reused figures and the trajectories of the jobs
             
-        ax = plt.figure().add_subplot(projection='3d')
-        
-        
-        for fname in self.tdict: 
-        
-            ax.scatter(
-                self.tdict[fname].data['X Position'].iloc[-1],
-                self.tdict[fname].data['Y Position'].iloc[-1],
-                self.tdict[fname].data['Z Position'].iloc[-1],
-
-                marker = 'o',
-                label = fname
-                )
+            figures.close()
+            _clear_worker_cache()
+        
+    elif jobs:
+        palette = sns.color_palette()
+        
+        with ProcessPoolExecutor(max_workers = workers,
+                                 initializer = _worker_init,
+                                 initargs = (palette,
+                                             trajectory_profile.settings(),
+                                             trajectory_writer.settings(),
+                                             trajectory_archive.target 
+                                             is not None)
+                                 ) as pool:
             
-        ax.set(
-            xlabel = 'X Position, km',
-            ylabel = 'Y Position, km',
-            zlabel = 'Z Position, km'
-            )
-        
-        ax.legend(bbox_to_anchor=(1,1), loc="upper left")
-
-        
-        if save:
-            plt.savefig('combined_end_3D.png',dpi = 300)
+            futures = [pool.submit(*job[2]) for job in jobs]
             
-        
-        
-        
-        plt.show()        
-
+            run(future.result for future in futures)
+            
+    # images still being written in this process; their jobs fail
     
+    for name, plot, error in _write_errors(jobs):
         
-           
-        
-           
+        print("Failed: " + name + " " + plot + "\n" + error)
+        failed.append((name, plot, error))
         
+        if manifest is not None:
+            built.pop(name + '/' + plot, None)
+            
+    if manifest is not None:
+        _write_manifest(manifest, built)
+                
+    print("Rendered " + str(len(jobs) - len(failed)) + " of " 
+          + str(len(jobs)) + " plots")
     
-        
-        
-        
-
+    return failed
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+
+# pixel aware decimation of plotted lines
+#
+# a trajectory at 0.1 s steps has 10k-15k points per series, many more than
+# the pixel columns of a 6.4 inch axis. the rows are split into one bucket
+# per pixel column of the axis and only the first and last row of each
+# bucket and the rows with the min and max of every plotted column are kept
+# (min/max per pixel column, "M4"). peaks such as apogee or max
+# acceleration are kept exactly and the drawn line looks the same.
+#
+# decimation only pays off for dense lines: encoding the saved PNG costs
+# the same whatever is drawn, and matplotlib already simplifies a path
+# with a few points per pixel while drawing it. lines with fewer than
+# min_density rows per pixel column are drawn as they are. the 19
+# separate plots of a synthetic trajectory (benchmark.py) saved at 300 dpi
+# took, best of 3 on one CPU:
+#
+#   rows      not decimated   decimated
+#   15000     4.1 s           4.6 s (before min_density; now drawn as is)
+#   30000     5.1 s           4.0 s
+#   60000     5.6 s           3.8 s
+#   150000    7.6 s           3.9 s
+
+import numpy as np
+
+
+# number of pixel columns of axes ax, or of a subplot axis in a figure
+# figwidth inches wide
+
+def pixel_columns(figwidth = None, dpi = None, ax = None):
+
+    # imported here, only when plotting (see trajectory_classes)
+
+    import matplotlib as mpl
+
+    if dpi is None:
+        dpi = mpl.rcParams['savefig.dpi']
+        if dpi == 'figure':
+            dpi = mpl.rcParams['figure.dpi']
+
+    if ax is not None:
+        figwidth = ax.figure.get_figwidth()
+        fraction = ax.get_position().width
+    else:
+        if figwidth is None:
+            figwidth = mpl.rcParams['figure.figsize'][0]
+
+        fraction = (mpl.rcParams['figure.subplot.right']
+                    - mpl.rcParams['figure.subplot.left'])
+
+    return max(int(figwidth * dpi * fraction), 1)
+
+
+min_density = 16          # decimate only lines with at least this many
+                          # rows per pixel column
+max_kept = 0.75           # and when at most this fraction of the rows is
+                          # kept
+
+
+# sorted indices of the rows to keep, or None if decimating wouldn't drop
+# enough rows to be worth it (see min_density and max_kept)
+
+def decimate_indices(columns, buckets):
+
+    columns = [np.asarray(c) for c in columns]
+    n = len(columns[0])
+
+    if n < min_density * buckets:
+        return None
+
+    size = -(-n // buckets)           # rows per bucket, rounded up
+    m = n // size * size              # rows in full buckets
+
+    starts = np.arange(0, m, size)
+
+    keep = [starts, starts + size - 1, [0, n - 1]]
+
+    for c in columns:
+        full = c[:m].reshape(-1, size)
+
+        keep.append(starts + full.argmin(axis = 1))
+        keep.append(starts + full.argmax(axis = 1))
+
+        if m < n:
+            rest = c[m:]
+            keep.append([m + rest.argmin(), m + rest.argmax()])
+
+    if m < n:
+        keep.append([m])
+
+    # the first, last, min and max rows of a bucket are often the same
+    # rows, so the rows kept are counted after removing duplicates
+
+    idx = np.unique(np.concatenate(keep).astype(np.intp))
+
+    if len(idx) > max_kept * n:
+        return None
+
+    return idx
+
+
+# the rows of data needed to draw the given columns at the pixel
+# resolution of axes ax, or of an axis in a figwidth inches wide figure
+
+def decimate(data, columns, figwidth = None, dpi = None, ax = None):
+
+    columns = list(columns)
+
+    idx = decimate_indices([data[c].to_numpy() for c in columns],
+                           pixel_columns(figwidth, dpi, ax))
+
+    if idx is None:
+        return data
+
+    return data[columns].iloc[idx]
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+
+# quantities derived from the columns of trajectory.data
+#
+# every quantity is computed for a whole trajectory in one vectorized pass
+# over the NumPy arrays of trajectory.data. trajectory.derive() adds them
+# to the data as ordinary columns (computed once per trajectory), so they
+# can be plotted like any other column.
+#
+# time derivatives use np.gradient (second order central differences), the
+# air density comes from the 1976 US Standard Atmosphere.
+
+import numpy as np
+
+
+g0 = 9.80665              # standard gravity, m/s^2
+
+
+# 1976 US Standard Atmosphere up to 86 km: base geopotential altitude (km),
+# base temperature (K), lapse rate (K/km) and base pressure (Pa) of the
+# layers. the last row is the 86 km top of the model (84.852 km
+# geopotential), continued as an isothermal layer
+
+atm_h = np.array([0.0, 11.0, 20.0, 32.0, 47.0, 51.0, 71.0, 84.852])
+atm_T = np.array([288.15, 216.65, 216.65, 228.65, 270.65, 270.65, 214.65,
+                  186.946])
+atm_L = np.array([-6.5, 0.0, 1.0, 2.8, 0.0, -2.8, -2.0, 0.0])
+atm_P = np.array([101325.0, 22632.06, 5474.889, 868.0187, 110.9063,
+                  66.93887, 3.956420, 0.3733834])
+
+atm_r0 = 6356.766         # earth radius of the geopotential altitude, km
+atm_gMR = 34.1632         # g0 * M / R, K/km
+atm_R = 287.053           # specific gas constant of air, J/(kg K)
+
+
+# air density (kg/m^3) at geometric altitudes h (km); above the 86 km top
+# of the model the temperature stays at its top value and the density
+# decays exponentially
+
+def air_density(h):
+
+    h = np.clip(np.asarray(h, dtype = float), 0.0, None)
+    h = atm_r0 * h / (atm_r0 + h)                     # geopotential
+
+    i = np.searchsorted(atm_h, h, side = 'right') - 1
+
+    dh = h - atm_h[i]
+    L = atm_L[i]
+    Tb = atm_T[i]
+
+    T = Tb + L * dh
+
+    # isothermal layers decay exponentially, the others follow a power law
+
+    P = np.empty_like(h)
+    iso = L == 0.0
+    grad = ~iso
+
+    P[iso] = atm_P[i][iso] * np.exp(-atm_gMR * dh[iso] / Tb[iso])
+    P[grad] = atm_P[i][grad] * (Tb[grad] / T[grad]) ** (atm_gMR / L[grad])
+
+    return P / (atm_R * T)
+
+
+def time_derivative(data, column):
+    return np.gradient(data[column].to_numpy(), data['Time'].to_numpy())
+
+
+# derived quantities
+#
+# each function takes trajectory.data and returns an array with one value
+# per row
+
+# dynamic pressure 1/2 rho V^2, kPa
+
+def dynamic_pressure(data):
+
+    v = data['Velocity'].to_numpy()
+
+    return 0.5 * air_density(data['Altitude'].to_numpy()) * v**2 * 1e-3
+
+
+# flight path angle, the angle of the velocity above the local horizon, deg
+
+def flight_path_angle(data):
+
+    climb = time_derivative(data, 'Altitude') * 1e3   # m/s
+    v = data['Velocity'].to_numpy()
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        s = np.clip(climb / v, -1.0, 1.0)
+
+    return np.degrees(np.arcsin(s))
+
+
+# specific mechanical energy V^2/2 + g0 h, MJ/kg
+
+def specific_energy(data):
+
+    v = data['Velocity'].to_numpy()
+    h = data['Altitude'].to_numpy() * 1e3
+
+    return (0.5 * v**2 + g0 * h) * 1e-6
+
+
+# jerk, time derivative of the acceleration magnitude, m/s^3
+
+def jerk(data):
+    return time_derivative(data, 'Acceleration')
+
+
+# rate of change of the ground range, m/s (the positions are inertial, so
+# distances from the launch point would include the rotation of the earth)
+
+def range_rate(data):
+    return time_derivative(data, 'Ground Range') * 1e3
+
+
+# total load factor from the body axis accelerations, g
+
+def g_load(data):
+
+    a = data[['Acceleration X', 'Acceleration Y',
+              'Acceleration Z']].to_numpy()
+
+    return np.sqrt((a**2).sum(axis = 1)) / g0
+
+
+# column name -> function computing it
+
+derived = {'Dynamic Pressure': dynamic_pressure,
+           'Flight Path Angle': flight_path_angle,
+           'Specific Energy': specific_energy,
+           'Jerk': jerk,
+           'Range Rate': range_rate,
+           'G Load': g_load}
+
+# axis labels of the derived columns
+
+labels = {'Dynamic Pressure': 'Dynamic Pressure, kPa',
+          'Flight Path Angle': 'Flight Path Angle, deg',
+          'Specific Energy': 'Specific Energy, MJ/kg',
+          'Jerk': 'Jerk, m/s$^3$',
+          'Range Rate': 'Range Rate, m/s',
+          'G Load': 'Load Factor, g'}
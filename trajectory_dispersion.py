@@ -0,0 +1,147 @@
+#!/usr/bin/python
+
+# dispersion of impact points
+#
+# statistics of the final downrange / crossrange points of an ensemble of
+# trajectories, computed from the catalog summaries (see trajectory_io), so
+# the trajectories themselves are never loaded:
+#
+#   MPI          mean point of impact
+#   CEP, R95     radius around the MPI holding 50 % / 95 % of the points
+#   ellipses     50 % and 95 % error ellipses of the bivariate normal
+#                distribution with the sample covariance
+#   outliers     points outside the outlier_probability ellipse
+#
+# everything is computed with a few vectorized NumPy operations over all
+# points. the result is kept in a small JSON file next to the catalog and
+# is recomputed only when the points or the settings change.
+
+import numpy as np
+
+import os
+import json
+import hashlib
+
+from trajectory_io import catalog_path, write_atomic
+
+
+dispersion_version = 1
+
+ellipse_probabilities = [0.5, 0.95]
+outlier_probability = 0.997
+
+columns = ['Final Downrange', 'Final Crossrange']
+
+
+# scale of the 1 sigma ellipse of a bivariate normal distribution that
+# holds the probability p (square root of the chi-squared quantile with 2
+# degrees of freedom)
+
+def ellipse_scale(p):
+    return np.sqrt(-2.0 * np.log(1.0 - p))
+
+
+# dispersion of points (N x 2 array of downrange, crossrange in km); names
+# are the names of the points, used for the outliers
+
+def dispersion(points, names = None):
+
+    points = np.asarray(points, dtype = float).reshape(-1, 2)
+    n = len(points)
+
+    if names is None:
+        names = [str(i) for i in range(n)]
+
+    if n == 0:
+        return {'N': 0}
+
+    mpi = points.mean(axis = 0)
+    dev = points - mpi
+    r = np.hypot(dev[:, 0], dev[:, 1])
+
+    result = {'N': n,
+              'MPI Downrange': float(mpi[0]),
+              'MPI Crossrange': float(mpi[1]),
+              'CEP': float(np.percentile(r, 50)),
+              'R95': float(np.percentile(r, 95))}
+
+    if n < 3:
+        return result
+
+    cov = np.cov(dev, rowvar = False)
+    sigma = np.sqrt(np.diag(cov))
+
+    result['Sigma Downrange'] = float(sigma[0])
+    result['Sigma Crossrange'] = float(sigma[1])
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        result['Correlation'] = float(np.nan_to_num(
+            cov[0, 1] / (sigma[0] * sigma[1])))
+
+    # principal axes: eigenvalues in ascending order, the last one is the
+    # major axis
+
+    values, vectors = np.linalg.eigh(cov)
+    values = np.clip(values, 0.0, None)
+    angle = np.degrees(np.arctan2(vectors[1, 1], vectors[0, 1]))
+    angle = (angle + 90.0) % 180.0 - 90.0     # direction of the axis only
+
+    for p in ellipse_probabilities:
+        k = ellipse_scale(p)
+        result['Ellipse %g%%' % (100 * p)] = {
+            'Semi-major': float(k * np.sqrt(values[1])),
+            'Semi-minor': float(k * np.sqrt(values[0])),
+            'Angle': float(angle)}
+
+    # squared Mahalanobis distances of all points at once
+
+    d2 = np.einsum('ij,jk,ik->i', dev, np.linalg.pinv(cov), dev)
+    outliers = d2 > ellipse_scale(outlier_probability)**2
+
+    result['Outliers'] = [names[i] for i in np.flatnonzero(outliers)]
+
+    return result
+
+
+# dispersion of the final points in the catalog summaries (name ->
+# summary) of directory dir1, kept in a JSON file next to the catalog
+
+def dispersion_path(dir1):
+    return catalog_path(dir1)[:-len('.json')] + '.dispersion.json'
+
+
+def read_dispersion(dir1, summaries):
+
+    names = [name for name in summaries
+             if all(c in summaries[name] for c in columns)]
+
+    points = np.array([[summaries[name][c] for c in columns]
+                       for name in names], dtype = float).reshape(-1, 2)
+
+    key = json.dumps([dispersion_version, ellipse_probabilities,
+                      outlier_probability, names])
+    key = hashlib.sha1(key.encode() + points.tobytes()).hexdigest()
+
+    path = dispersion_path(dir1)
+
+    try:
+        with open(path) as fh:
+            cached = json.load(fh)
+
+        if cached['key'] == key:
+            return cached['dispersion']
+
+    except (OSError, KeyError, ValueError):
+        pass
+
+    result = dispersion(points, names)
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        write_atomic(path, lambda fh: json.dump({'key': key,
+                                                 'dispersion': result},
+                                                fh, indent = 1))
+    except OSError:
+        pass
+
+    return result
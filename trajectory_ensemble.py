@@ -0,0 +1,128 @@
+#!/usr/bin/python
+
+# ensembles of trajectories resampled onto a common grid
+#
+# every trajectory has its own time vector and length. align() linearly
+# interpolates selected columns of all trajectories onto one shared grid:
+# either the time (from the earliest start to the latest end of the
+# trajectories; points outside the time window of a trajectory are NaN) or
+# the flight fraction (0 at the start and 1 at the end of every
+# trajectory). the result is a dense trajectories x grid points x columns
+# array, so the mean, spread and percentiles over the ensemble are single
+# NumPy reductions along its first axis.
+
+import numpy as np
+
+
+default_points = 1000     # grid points when none are given
+
+
+# values (rows x columns) at times t interpolated to the grid; NaN outside
+# the first and last time
+
+def resample(t, values, grid):
+
+    out = np.full((len(grid), values.shape[1]), np.nan)
+
+    if len(t) < 2:
+        return out
+
+    # one index and weight per grid point, shared by all columns
+
+    i = np.clip(np.searchsorted(t, grid), 1, len(t) - 1)
+    t0 = t[i - 1]
+    dt = t[i] - t0
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        w = np.where(dt > 0, (grid - t0) / dt, 0.0)
+
+    inside = (grid >= t[0]) & (grid <= t[-1])
+
+    v0 = values[i - 1]
+    out[inside] = (v0 + w[:, None] * (values[i] - v0))[inside]
+
+    return out
+
+
+# columns of many trajectories on a common grid
+#
+# values[i, j, k] is column k of trajectory names[i] at grid[j]
+
+class ensemble:
+
+    def __init__(self, names, columns, grid, values, fraction):
+        self.names = names
+        self.columns = columns
+        self.grid = grid              # times, or flight fractions
+        self.values = values
+        self.fraction = fraction
+
+
+    # trajectories x grid points array of a column
+
+    def field(self, column):
+        return self.values[:, :, self.columns.index(column)]
+
+
+    # statistics of a column over the ensemble, one value per grid point;
+    # trajectories without data at a grid point are left out
+
+    def mean(self, column):
+        return np.nanmean(self.field(column), axis = 0)
+
+    def std(self, column):
+        return np.nanstd(self.field(column), axis = 0)
+
+    def percentiles(self, column, q):
+        return np.nanpercentile(self.field(column), q, axis = 0)
+
+    def count(self, column):
+        return np.isfinite(self.field(column)).sum(axis = 0)
+
+
+# align the given columns of trajectories onto a grid of the given number
+# of points
+#
+# names are the trajectory names and load(name) returns the data of a
+# trajectory (for a time grid it is called twice per name: for the time
+# window of the ensemble, then for the values)
+
+def align(names, load, columns, points = None, fraction = False):
+
+    names = list(names)
+    columns = list(columns)
+
+    if points is None:
+        points = default_points
+
+    if fraction:
+        grid = np.linspace(0.0, 1.0, points)
+    else:
+        start = np.inf
+        end = -np.inf
+
+        for name in names:
+            t = load(name)['Time'].to_numpy()
+
+            if len(t):
+                start = min(start, t[0])
+                end = max(end, t[-1])
+
+        if start > end:
+            start = end = 0.0
+
+        grid = np.linspace(start, end, points)
+
+    values = np.full((len(names), points, len(columns)), np.nan)
+
+    for i, name in enumerate(names):
+
+        data = load(name)
+        t = data['Time'].to_numpy(dtype = float)
+
+        if fraction and len(t) > 1 and t[-1] > t[0]:
+            t = (t - t[0]) / (t[-1] - t[0])
+
+        values[i] = resample(t, data[columns].to_numpy(dtype = float), grid)
+
+    return ensemble(names, columns, grid, values, fraction)
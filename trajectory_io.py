@@ -0,0 +1,610 @@
+#!/usr/bin/python
+
+# reading of simulator trajectory files
+#
+# a trajectory file is a CSV with the fixed simulator header
+# (TTIME_S, TRXI_M, ... TAMACH). after reading, the columns are renamed and
+# positions, downrange and crossrange are converted to km.
+#
+# files with exactly this header are read by a typed fast path: an explicit
+# dtype for every column (no type inference), optionally float32, parsed by
+# the multithreaded pyarrow reader when it is installed, or by the pandas C
+# parser on several threads, one per block of rows. any other header falls
+# back to a plain pd.read_csv.
+#
+# files too large for memory can be read as a stream of converted chunks
+# of rows (iter_chunks) and reduced to a summary (apogee, max Mach, final
+# position, time window, ...) one chunk at a time (summarize).
+#
+# files still being written by the simulator can be followed (tail): only
+# the complete rows appended since the last read are parsed.
+#
+# the summaries of all files of a directory are kept in a small JSON
+# catalog next to the cache files (read_catalog); an entry is recomputed
+# only when its file changes.
+#
+# parsed frames are cached in a binary sidecar file (.npz holding one
+# contiguous row of values per column) so that unchanged CSV files don't
+# have to be parsed again.
+# the cache is keyed on the path, size and modification time of the CSV and
+# on the rename/scale rules below and is rebuilt automatically when any of
+# them changes.
+
+import pandas as pd
+import numpy as np
+
+import os
+import io
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from trajectory_profile import stage
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+# simulator column names and the names used in trajectory.data
+
+columns = {'TTIME_S':'Time',
+           'TRXI_M':'X Position',
+           'TRYI_M':'Y Position',
+           'TRZI_M':'Z Position',
+           'TGRNKM_KM':'Ground Range',
+           'TALTKM_KM':'Altitude',
+           'TDRNGE_M':'Downrange',
+           'TCRNGE_M':'Crossrange',
+           'TVRMAG_M/S':'Velocity',
+           'TAIMAG_M/S2':'Acceleration',
+           'TABXB_M/S2':'Acceleration X',
+           'TABYB_M/S2':'Acceleration Y',
+           'TABZB_M/S2':'Acceleration Z',
+           'TPITCH_DEG':'Pitch Angle',
+           'THEADG_DEG':'Heading Angle',
+           'TAMACH':'Mach'}
+
+# columns converted from m to km
+
+km_columns = ['X Position', 'Y Position', 'Z Position',
+              'Downrange', 'Crossrange']
+
+km_scale = 1e-3
+
+
+# typed fast path settings
+#
+# float32 = True halves the memory of a frame (about 7 significant digits),
+# threads = None uses one parser thread per CPU
+
+dtypes = {c: 'float64' for c in columns}
+
+float32 = False
+threads = None
+min_block = 2**20         # smallest block of a file parsed by one thread
+report = False            # print parse throughput
+
+parse_stats = {}          # file, size, time, throughput and engine of the
+                          # last parse
+
+chunksize = 100000        # rows per chunk when streaming a file
+
+
+# cache settings
+#
+# cache_dir = None keeps the cache in a '.trajectory_cache' directory next to
+# the CSV files, otherwise all cache files go to cache_dir
+
+use_cache = True
+cache_dir = None
+cache_version = 1
+catalog_version = 1
+
+
+# rename columns and convert positions, crossrange and downrange to km
+
+def convert(data):
+
+    data.rename(columns = columns, inplace = True)
+
+    for c in km_columns:
+        data[c] = data[c] * km_scale
+
+    return data
+
+
+# header of a trajectory file as a list of column names
+
+def read_header(f):
+
+    with open(f) as fh:
+        return fh.readline().strip().split(',')
+
+
+# typed parse of a file with the simulator header
+
+def read_typed(f):
+
+    if float32:
+        dtype = {c: 'float32' for c in dtypes}
+    else:
+        dtype = dtypes
+
+    if pyarrow is not None:
+        return pd.read_csv(f, dtype = dtype, engine = 'pyarrow'), 'pyarrow'
+
+    with open(f, 'rb') as fh:
+        raw = fh.read()
+
+    n = threads or os.cpu_count() or 1
+    n = min(n, len(raw) // min_block)
+
+    if n <= 1:
+        return pd.read_csv(io.BytesIO(raw), dtype = dtype), 'c'
+
+    # split the rows after the header into n blocks at line ends
+
+    start = raw.index(b'\n') + 1
+    names = list(columns)
+
+    bounds = [start]
+
+    for i in range(1, n):
+        pos = raw.find(b'\n', start + (len(raw) - start) * i // n)
+        if pos < 0:
+            break
+        if pos + 1 > bounds[-1]:
+            bounds.append(pos + 1)
+
+    bounds.append(len(raw))
+
+    def parse(i):
+        return pd.read_csv(io.BytesIO(raw[bounds[i]:bounds[i + 1]]),
+                           header = None, names = names, dtype = dtype)
+
+    with ThreadPoolExecutor(max_workers = len(bounds) - 1) as pool:
+        blocks = list(pool.map(parse, range(len(bounds) - 1)))
+
+    return pd.concat(blocks, ignore_index = True), 'c, %d threads' % len(blocks)
+
+
+# read and convert a trajectory file without using the cache
+
+def read_trajectory(f):
+
+    t0 = time.perf_counter()
+
+    if read_header(f) == list(columns):
+        data, engine = read_typed(f)
+    else:
+        data, engine = pd.read_csv(f), 'generic'
+
+    seconds = time.perf_counter() - t0
+    size = os.path.getsize(f)
+
+    parse_stats.clear()
+    parse_stats.update({'file': f,
+                        'bytes': size,
+                        'seconds': seconds,
+                        'MB/s': size / 1e6 / max(seconds, 1e-9),
+                        'engine': engine})
+
+    if report:
+        print('%s: %.1f MB in %.3f s, %.1f MB/s (%s)'
+              % (f, size / 1e6, seconds, parse_stats['MB/s'], engine))
+
+    with stage('transform', stage_name(f)):
+        return convert(data)
+
+
+# name of the trajectory of file f in the stage records
+
+def stage_name(f):
+    return os.path.splitext(os.path.basename(f))[0]
+
+
+# iterate over a trajectory file in chunks of rows, each chunk already
+# renamed and converted to km
+
+def iter_chunks(f, rows = None):
+
+    if rows is None:
+        rows = chunksize
+
+    if read_header(f) == list(columns):
+        if float32:
+            dtype = {c: 'float32' for c in dtypes}
+        else:
+            dtype = dtypes
+    else:
+        dtype = None
+
+    with pd.read_csv(f, dtype = dtype, chunksize = rows) as reader:
+        for chunk in reader:
+            yield convert(chunk)
+
+
+# reading of a file that is still being written
+#
+# read() parses only the complete rows appended since the last call
+# (starting at the byte offset after the last newline read; a partly
+# written last row is left for the next call), converts them like a whole
+# file and appends them to a buffer that grows by doubling, so the cost of
+# an update is proportional to the new data. frame() is a view of the rows
+# read so far. a file that shrinks (rewritten) is read again from the start.
+
+class tail:
+
+    def __init__(self, f):
+        self.f = f
+        self.offset = 0           # bytes of the file read
+        self.names = None         # header of the file
+        self.columns = None       # columns after convert()
+        self.rows = 0
+        self.buffer = None        # columns x capacity
+
+
+    # read the new complete rows and return their number
+
+    def read(self):
+
+        with open(self.f, 'rb') as fh:
+
+            if os.fstat(fh.fileno()).st_size < self.offset:
+                self.__init__(self.f)
+
+            fh.seek(self.offset)
+            raw = fh.read()
+
+        end = raw.rfind(b'\n') + 1
+        raw = raw[:end]
+
+        if not raw:
+            return 0
+
+        self.offset += len(raw)
+
+        if self.names is None:
+            start = raw.index(b'\n') + 1
+            self.names = raw[:start].decode().strip().split(',')
+            raw = raw[start:]
+
+        if not raw.strip():
+            return 0
+
+        if self.names == list(columns):
+            dtype = 'float32' if float32 else 'float64'
+        else:
+            dtype = None
+
+        chunk = convert(pd.read_csv(io.BytesIO(raw), header = None,
+                                    names = self.names, dtype = dtype))
+
+        self.append(chunk)
+
+        return len(chunk)
+
+
+    def append(self, chunk):
+
+        values = chunk.to_numpy(dtype = 'float32' if float32 else 'float64').T
+
+        if self.buffer is None:
+            self.columns = list(chunk.columns)
+            self.buffer = np.empty((len(self.columns), 
+                                    max(2 * len(chunk), 1024)),
+                                   dtype = values.dtype)
+
+        n = self.rows + values.shape[1]
+
+        if n > self.buffer.shape[1]:
+            grown = np.empty((self.buffer.shape[0], 
+                              max(2 * self.buffer.shape[1], n)),
+                             dtype = self.buffer.dtype)
+            grown[:, :self.rows] = self.buffer[:, :self.rows]
+            self.buffer = grown
+
+        self.buffer[:, self.rows:n] = values
+        self.rows = n
+
+
+    # the rows read so far, as a frame without a copy
+
+    def frame(self):
+
+        if self.buffer is None:
+            return pd.DataFrame()
+
+        return pd.DataFrame(self.buffer[:, :self.rows].T, 
+                            columns = self.columns, copy = False)
+
+
+# running reductions over the chunks of a trajectory
+#
+# update() takes consecutive chunks (or a whole frame), result() returns
+# the summary as a dict
+
+class running_summary:
+
+    # columns whose maximum (and the time it occurs) is tracked
+
+    peak_columns = {'Altitude': 'Apogee',
+                    'Mach': 'Max Mach',
+                    'Velocity': 'Max Velocity',
+                    'Acceleration': 'Max Acceleration'}
+
+
+    def __init__(self):
+        self.rows = 0
+        self.first = None
+        self.last = None
+        self.peaks = {}           # column -> (max value, time of max)
+
+
+    def update(self, chunk):
+
+        if len(chunk) == 0:
+            return self
+
+        self.rows += len(chunk)
+
+        if self.first is None:
+            self.first = chunk.iloc[0]
+
+        self.last = chunk.iloc[-1]
+
+        for c in self.peak_columns:
+            if c not in chunk:
+                continue
+
+            i = chunk[c].to_numpy().argmax()
+            value = float(chunk[c].iloc[i])
+
+            if c not in self.peaks or value > self.peaks[c][0]:
+                self.peaks[c] = (value, float(chunk['Time'].iloc[i]))
+
+        return self
+
+
+    def result(self):
+
+        if self.rows == 0:
+            return {'Rows': 0}
+
+        r = {'Rows': self.rows,
+             'Start Time': float(self.first['Time']),
+             'End Time': float(self.last['Time']),
+             'Flight Time': float(self.last['Time'] - self.first['Time'])}
+
+        for c in self.peaks:
+            name = self.peak_columns[c]
+            r[name] = self.peaks[c][0]
+            r[name + ' Time'] = self.peaks[c][1]
+
+        for c in ['X Position', 'Y Position', 'Z Position', 'Ground Range',
+                  'Altitude', 'Downrange', 'Crossrange', 'Velocity', 'Mach']:
+            if c in self.last:
+                r['Final ' + c] = float(self.last[c])
+
+        return r
+
+
+# summary of a trajectory file, computed chunk by chunk
+
+def summarize(f, rows = None):
+
+    summary = running_summary()
+
+    for chunk in iter_chunks(f, rows):
+        summary.update(chunk)
+
+    return summary.result()
+
+
+# sha1 of the content of a file, remembered for as long as its size and
+# modification time don't change
+
+file_hashes = {}
+
+def file_hash(f):
+
+    st = os.stat(f)
+    key = (os.path.abspath(f), st.st_size, st.st_mtime_ns)
+
+    if key not in file_hashes:
+        h = hashlib.sha1()
+
+        with open(f, 'rb') as fh:
+            for block in iter(lambda: fh.read(2**20), b''):
+                h.update(block)
+
+        file_hashes[key] = h.hexdigest()
+
+    return file_hashes[key]
+
+
+# hash of everything that changes the content of a cached frame
+
+def rules_hash():
+
+    rules = json.dumps([cache_version, columns, km_columns, km_scale,
+                        float32])
+
+    return hashlib.sha1(rules.encode()).hexdigest()
+
+
+# write path through a temporary file next to it, filled by write(fh) and
+# then renamed over path, so that readers (other processes included) never
+# see a partial file; the temporary file is removed if writing fails
+
+def write_atomic(path, write, mode = 'w'):
+
+    tmp = path + '.' + str(os.getpid()) + '.tmp'
+
+    try:
+        with open(tmp, mode) as fh:
+            write(fh)
+
+        os.replace(tmp, path)
+
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def cache_path(f):
+
+    bn = os.path.basename(f)
+
+    if cache_dir is None:
+        d = os.path.join(os.path.dirname(os.path.abspath(f)), '.trajectory_cache')
+        return os.path.join(d, bn + '.npz')
+
+    # files from different directories share cache_dir, so the name also
+    # carries a hash of the full path
+
+    h = hashlib.sha1(os.path.abspath(f).encode()).hexdigest()[:12]
+
+    return os.path.join(cache_dir, bn + '.' + h + '.npz')
+
+
+def cache_key(f):
+
+    st = os.stat(f)
+
+    return json.dumps({'path': os.path.abspath(f),
+                       'size': st.st_size,
+                       'mtime': st.st_mtime_ns,
+                       'rules': rules_hash()})
+
+
+# return the cached frame for f, or None if there is no valid cache entry
+
+def read_cache(f, key):
+
+    try:
+        with np.load(cache_path(f), allow_pickle = False) as npz:
+
+            if str(npz['__key__']) != key:
+                return None
+
+            names = [str(c) for c in npz['__columns__']]
+
+            # one row per column; the transposed view becomes the frame's
+            # single block without a copy
+
+            return pd.DataFrame(npz['data'].T, columns = names, copy = False)
+
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+# store a frame in the cache; frames with mixed column types and caches
+# that can't be written are skipped
+
+def write_cache(f, key, data):
+
+    if len(set(data.dtypes)) != 1:
+        return
+
+    path = cache_path(f)
+
+    def write(fh):
+        np.savez(fh,
+                 __key__ = np.array(key),
+                 __columns__ = np.array(list(data.columns)),
+                 data = np.ascontiguousarray(data.to_numpy().T))
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        write_atomic(path, write, 'wb')
+    except OSError:
+        pass
+
+
+# load a trajectory file, using the binary cache when possible
+
+def load_trajectory(f, cache = None):
+
+    if cache is None:
+        cache = use_cache
+
+    with stage('load', stage_name(f)):
+
+        if not cache:
+            return read_trajectory(f)
+
+        key = cache_key(f)
+
+        data = read_cache(f, key)
+
+        if data is None:
+            data = read_trajectory(f)
+            write_cache(f, key, data)
+
+        return data
+
+
+# catalog of the summaries of the files in a directory
+#
+# the catalog is a JSON file mapping file names to their size, mtime,
+# rules hash and summary. entries of changed files are recomputed,
+# entries of removed files dropped.
+
+def catalog_path(dir1):
+
+    if cache_dir is None:
+        return os.path.join(os.path.abspath(dir1), '.trajectory_cache',
+                            'catalog.json')
+
+    h = hashlib.sha1(os.path.abspath(dir1).encode()).hexdigest()[:12]
+
+    return os.path.join(cache_dir, 'catalog.' + h + '.json')
+
+
+# summaries of the given files of dir1, as a dict file name -> summary
+
+def read_catalog(dir1, files):
+
+    path = catalog_path(dir1)
+
+    try:
+        with open(path) as fh:
+            catalog = json.load(fh)
+    except (OSError, ValueError):
+        catalog = {}
+
+    rules = rules_hash() + '.' + str(catalog_version)
+
+    changed = set(catalog) - set(files)
+    summaries = {}
+
+    for f in files:
+
+        st = os.stat(os.path.join(dir1, f))
+        key = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'rules': rules}
+
+        entry = catalog.get(f)
+
+        if entry is None or entry['key'] != key:
+            entry = {'key': key,
+                     'summary': summarize(os.path.join(dir1, f))}
+            catalog[f] = entry
+            changed.add(f)
+
+        summaries[f] = entry['summary']
+
+    for f in set(catalog) - set(files):
+        del catalog[f]
+
+    if changed:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+            write_atomic(path, lambda fh: json.dump(catalog, fh, indent = 1))
+        except OSError:
+            pass
+
+    return summaries
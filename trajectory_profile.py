@@ -0,0 +1,249 @@
+#!/usr/bin/python
+
+# stage level instrumentation
+#
+# the work on every trajectory and plot is split into stages:
+#
+#   load        reading a file (parsing, or the binary cache)
+#   transform   renaming/scaling, derived quantities, decimation
+#   draw        creating or updating the artists of a plot
+#   save        rendering and encoding the figure in savefig
+#
+# the code of each stage runs in "with stage('load', name, plot):". when
+# instrumentation is off (the default) stage() returns a shared no-op
+# context, so the cost is one function call. when on, every stage records
+# its wall time, its self time (without the stages nested in it) and,
+# optionally, the memory allocated in it (tracemalloc), and can feed one
+# cProfile profile per stage kind, e.g.
+#
+#   import trajectory_profile
+#   trajectory_profile.enable(memory = True, profile_dir = 'prof')
+#   tdir.plot_all_separate(save = True, workers = 4)
+#   trajectory_profile.report('stages.csv')
+#
+# records of worker processes are sent back with the results of their
+# jobs; their profiles are dumped as <stage>.<pid>.prof.
+
+import os
+import csv
+import json
+import time
+import cProfile
+import tracemalloc
+
+
+enabled = False
+memory = False            # track allocated memory (slows down allocation)
+profile_dir = None        # directory of the cProfile dumps, or None
+
+records = []              # one dict per finished stage
+profiles = {}             # stage kind -> cProfile.Profile
+active = []               # stages entered and not yet left, innermost last
+
+
+class off_stage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+off = off_stage()
+
+
+class running_stage:
+
+    def __init__(self, kind, name, plot):
+        self.kind = kind
+        self.name = name
+        self.plot = plot
+        self.nested = 0.0         # seconds of the stages nested in this one
+        self.peak = 0             # peak of traced memory while running
+
+
+    def __enter__(self):
+
+        if active:
+            parent = active[-1]
+
+            if memory:
+                parent.peak = max(parent.peak,
+                                  tracemalloc.get_traced_memory()[1])
+
+            if profile_dir is not None:
+                profiles[parent.kind].disable()
+
+        active.append(self)
+
+        if memory:
+            tracemalloc.reset_peak()
+            self.memory = tracemalloc.get_traced_memory()[0]
+
+        if profile_dir is not None:
+            profiles.setdefault(self.kind, cProfile.Profile()).enable()
+
+        self.start = time.perf_counter()
+
+        return self
+
+
+    def __exit__(self, *exc):
+
+        seconds = time.perf_counter() - self.start
+
+        if profile_dir is not None:
+            profiles[self.kind].disable()
+
+        active.pop()
+
+        record = {'stage': self.kind,
+                  'trajectory': self.name,
+                  'plot': self.plot,
+                  'seconds': seconds,
+                  'self seconds': seconds - self.nested,
+                  'pid': os.getpid()}
+
+        if memory:
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+
+            record['memory'] = current - self.memory
+            record['peak memory'] = self.peak - self.memory
+
+        records.append(record)
+
+        if active:
+            parent = active[-1]
+            parent.nested += seconds
+
+            if memory:
+                parent.peak = max(parent.peak, self.peak)
+                tracemalloc.reset_peak()
+
+            if profile_dir is not None:
+                profiles[parent.kind].enable()
+
+        return False
+
+
+# context of a stage of trajectory name and plot
+
+def stage(kind, name = '', plot = ''):
+
+    if not enabled:
+        return off
+
+    return running_stage(kind, name, plot)
+
+
+def enable(memory = False, profile_dir = None):
+    settings({'enabled': True, 'memory': memory,
+              'profile_dir': profile_dir})
+
+
+def disable():
+    settings({'enabled': False, 'memory': False, 'profile_dir': None})
+
+
+# settings as a dict (sent to worker processes) or set from one
+
+def settings(new = None):
+
+    global enabled, memory, profile_dir
+
+    if new is None:
+        return {'enabled': enabled, 'memory': memory,
+                'profile_dir': profile_dir}
+
+    enabled = new['enabled']
+    memory = new['memory']
+    profile_dir = new['profile_dir']
+
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok = True)
+
+
+def reset():
+    records.clear()
+    profiles.clear()
+
+
+# take the records collected so far (used by worker processes)
+
+def collect():
+
+    taken = list(records)
+    records.clear()
+
+    return taken
+
+
+# total, self time and count of every stage kind
+
+def totals():
+
+    result = {}
+
+    for r in records:
+        t = result.setdefault(r['stage'], {'count': 0, 'seconds': 0.0,
+                                           'self seconds': 0.0})
+        t['count'] += 1
+        t['seconds'] += r['seconds']
+        t['self seconds'] += r['self seconds']
+
+    return result
+
+
+# write the cProfile profile of every stage kind to profile_dir as
+# <stage>.prof (<stage>.<pid>.prof with pid)
+
+def dump_profiles(pid = None):
+
+    if profile_dir is None:
+        return
+
+    for kind, p in profiles.items():
+
+        name = kind if pid is None else kind + '.' + str(pid)
+        p.dump_stats(os.path.join(profile_dir, name + '.prof'))
+
+
+# write the records to path, as CSV for a .csv file and otherwise as JSON
+# with the totals per stage kind, print the totals and dump the profiles
+
+def report(path = None):
+
+    t = totals()
+
+    for kind in t:
+        print('%-10s %6d x %10.3f s (self %.3f s)'
+              % (kind, t[kind]['count'], t[kind]['seconds'],
+                 t[kind]['self seconds']))
+
+    if path is not None and path.endswith('.csv'):
+
+        fields = []
+
+        for r in records:
+            fields += [k for k in r if k not in fields]
+
+        with open(path, 'w', newline = '') as fh:
+            writer = csv.DictWriter(fh, fieldnames = fields)
+            writer.writeheader()
+            writer.writerows(records)
+
+    elif path is not None:
+
+        with open(path, 'w') as fh:
+            json.dump({'totals': t, 'records': records}, fh, indent = 1)
+
+    dump_profiles()
+
+    return t
@@ -0,0 +1,392 @@
+#!/usr/bin/python
+
+# memory mapped store of all trajectories of a directory
+#
+# the frames of all trajectory files of a directory are consolidated into a
+# single binary file (.npy) holding one contiguous row of values per column,
+# the trajectories one after the other, and a small JSON index with the
+# names, columns and row offsets of the trajectories.
+#
+# the data file is memory mapped read only: opening the store reads only
+# the index, and the frame of a trajectory is a view of its row range
+# without a copy. pages are read by the OS on first access and are shared
+# by all processes mapping the same store.
+#
+# the store is rebuilt when a file of the directory is added, removed or
+# changed, or when the rename/scale rules change (see trajectory_io).
+#
+# the same layout can be published into shared memory for worker processes
+# (share_frames, attach_store, see below).
+
+import pandas as pd
+import numpy as np
+
+import os
+import json
+import weakref
+import hashlib
+from multiprocessing import shared_memory
+
+import trajectory_io
+from trajectory_io import load_trajectory, rules_hash, write_atomic
+
+
+store_version = 1
+
+
+# directory of the store of dir1, next to the cache files
+
+def store_path(dir1):
+
+    if trajectory_io.cache_dir is None:
+        return os.path.join(os.path.abspath(dir1), '.trajectory_cache',
+                            'store')
+
+    h = hashlib.sha1(os.path.abspath(dir1).encode()).hexdigest()[:12]
+
+    return os.path.join(trajectory_io.cache_dir, 'store.' + h)
+
+
+# size and modification time of the files and the rules the store was
+# built with
+
+def store_key(dir1, files):
+
+    key = {'version': store_version, 'rules': rules_hash(), 'files': {}}
+
+    for f in files:
+        st = os.stat(os.path.join(dir1, f))
+        key['files'][f] = [st.st_size, st.st_mtime_ns]
+
+    return key
+
+
+def _write_json(path, obj):
+    write_atomic(path, lambda fh: json.dump(obj, fh))
+
+
+# consolidated, read only view of the trajectories of a directory
+
+class trajectory_store:
+
+    def __init__(self, path, index):
+        self.path = path
+        self.names = index['names']            # trajectory names
+        self.columns = index['columns']
+        self.offsets = index['offsets']        # rows of trajectory i are
+                                               # offsets[i]:offsets[i + 1]
+        self.rows = {name: i for i, name in enumerate(self.names)}
+
+        # columns x rows of all trajectories
+
+        self.data = np.load(os.path.join(path, index['data']),
+                            mmap_mode = 'r')
+
+
+    # frame of a trajectory as a view of the mapped data
+
+    def frame(self, fname):
+
+        i = self.rows[fname]
+        rows = self.data[:, self.offsets[i]:self.offsets[i + 1]]
+
+        return pd.DataFrame(rows.T, columns = self.columns, copy = False)
+
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, fname):
+        return fname in self.rows
+
+
+# open the store of the given files of dir1, or return None if there is no
+# store or it is out of date
+
+def open_store(dir1, files):
+
+    path = store_path(dir1)
+
+    try:
+        with open(os.path.join(path, 'index.json')) as fh:
+            index = json.load(fh)
+
+        if index['key'] != store_key(dir1, files):
+            return None
+
+        return trajectory_store(path, index)
+
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+# consolidate the given files of dir1 into a new store; all files must
+# have the same columns
+
+def build_store(dir1, files):
+
+    path = store_path(dir1)
+    os.makedirs(path, exist_ok = True)
+
+    key = store_key(dir1, files)
+
+    # first pass: columns, type and rows of every file. the parsed frames
+    # go to the binary cache, so the second pass doesn't parse them again
+
+    columns = None
+    dtypes = []
+    lengths = []
+
+    for f in files:
+
+        data = load_trajectory(os.path.join(dir1, f))
+
+        if columns is None:
+            columns = list(data.columns)
+        elif list(data.columns) != columns:
+            raise ValueError(f + ': columns differ from ' + files[0])
+
+        dtypes += list(data.dtypes)
+        lengths.append(len(data))
+
+    if columns is None:
+        columns = []
+
+    offsets = [0]
+
+    for n in lengths:
+        offsets.append(offsets[-1] + n)
+
+    dtype = np.result_type(*dtypes) if dtypes else np.float64
+
+    # second pass: copy every frame into its row range of the data file
+
+    name = ('data.' + hashlib.sha1(json.dumps(key).encode()).hexdigest()[:12]
+            + '.npy')
+    tmp = os.path.join(path, name + '.' + str(os.getpid()) + '.tmp')
+
+    try:
+        out = np.lib.format.open_memmap(tmp, mode = 'w+', dtype = dtype,
+                                        shape = (len(columns), offsets[-1]))
+
+        for i, f in enumerate(files):
+            data = load_trajectory(os.path.join(dir1, f))
+            out[:, offsets[i]:offsets[i + 1]] = data.to_numpy().T
+
+        out.flush()
+        del out
+
+        os.replace(tmp, os.path.join(path, name))
+
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    index = {'key': key,
+             'data': name,
+             'names': [os.path.splitext(f)[0] for f in files],
+             'columns': columns,
+             'offsets': offsets}
+
+    _write_json(os.path.join(path, 'index.json'), index)
+
+    # data files of earlier builds; processes still mapping them keep their
+    # pages until they close the mapping
+
+    for f in os.listdir(path):
+        if f.startswith('data.') and f != name and not f.endswith('.tmp'):
+            os.remove(os.path.join(path, f))
+
+    return trajectory_store(path, index)
+
+
+# the store of the given files of dir1, built first if it is missing or
+# out of date
+
+def load_store(dir1, files):
+
+    store = open_store(dir1, files)
+
+    if store is None:
+        store = build_store(dir1, files)
+
+    return store
+
+
+# shared memory
+#
+# a loaded directory can be published once into a shared memory segment
+# with the same layout (columns x rows of all trajectories and the index),
+# which worker processes attach to by name: their frames are views of the
+# segment, nothing is parsed, pickled or copied per worker.
+#
+# the segment starts with the length of the JSON index (8 bytes) and the
+# index; the data follows, aligned to 64 bytes. the process that published
+# the segment unlinks it on close() (also when used in a with statement,
+# and at exit as a last resort); attached processes only unmap it.
+
+_align = 64
+
+
+class shared_store(trajectory_store):
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.name = shm.name
+        self.owner = owner
+        self.pid = os.getpid()
+        self.closed = False
+
+        n = int(np.frombuffer(shm.buf, np.uint64, 1)[0])
+        index = json.loads(bytes(shm.buf[8:8 + n]).decode())
+
+        self.names = index['names']
+        self.columns = index['columns']
+        self.offsets = index['offsets']
+        self.rows = {name: i for i, name in enumerate(self.names)}
+
+        self.data = np.ndarray((len(self.columns), self.offsets[-1]),
+                               dtype = index['dtype'], buffer = shm.buf,
+                               offset = index['start'])
+
+        if not owner:
+            self.data.flags.writeable = False
+
+        self.finalizer = weakref.finalize(self, _release, shm, owner,
+                                          os.getpid())
+
+
+    # unmap the segment, and remove it if this process published it;
+    # frames of the store must not be used afterwards
+
+    def close(self):
+        self.closed = True
+        self.data = None
+        self.finalizer()
+
+        if published.get(self.name) is self:
+            del published[self.name]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _release(shm, owner, pid):
+
+    # frames still referencing the segment keep it mapped until they are
+    # collected; the name is removed anyway
+
+    try:
+        shm.close()
+    except BufferError:
+        pass
+
+    # forked children inherit the finalizer but never own the segment
+
+    if owner and os.getpid() == pid:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+# publish frames into a new shared memory segment
+#
+# names are the trajectory names and load(name) returns the frame of a
+# trajectory (called twice per name: for the sizes, then to copy the data).
+# only the columns present in all frames are shared.
+
+def share_frames(names, load):
+
+    names = list(names)
+
+    columns = None
+    dtypes = []
+    lengths = []
+
+    for name in names:
+        data = load(name)
+
+        if columns is None:
+            columns = list(data.columns)
+        else:
+            columns = [c for c in columns if c in data]
+
+        dtypes += list(data.dtypes)
+        lengths.append(len(data))
+
+    columns = columns or []
+
+    offsets = [0]
+
+    for n in lengths:
+        offsets.append(offsets[-1] + n)
+
+    dtype = np.dtype(np.result_type(*dtypes) if dtypes else np.float64)
+
+    index = {'names': names, 'columns': columns, 'offsets': offsets,
+             'dtype': dtype.str}
+
+    # the start of the data is part of the index; 20 characters are
+    # reserved for it
+
+    n = len(json.dumps(index).encode()) + len(', "start": ') + 20
+    start = -(-(8 + n) // _align) * _align
+    index['start'] = start
+
+    header = json.dumps(index).encode()
+    size = start + len(columns) * offsets[-1] * dtype.itemsize
+
+    shm = shared_memory.SharedMemory(create = True, size = max(size, 1))
+
+    try:
+        shm.buf[:8] = np.array([len(header)], np.uint64).tobytes()
+        shm.buf[8:8 + len(header)] = header
+
+        store = shared_store(shm, True)
+
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+
+    try:
+        for i, name in enumerate(names):
+            store.data[:, offsets[i]:offsets[i + 1]] = \
+                load(name)[columns].to_numpy().T
+
+    except BaseException:
+        store.close()
+        raise
+
+    published[store.name] = store
+
+    return store
+
+
+# open stores published by this process, by segment name
+
+published = weakref.WeakValueDictionary()
+
+
+# attach to a segment published by share_frames in another process; the
+# segments published by this process are not mapped again, their store is
+# returned (and must not be closed by the caller)
+
+def attach_store(name):
+
+    store = published.get(name)
+
+    if store is not None and store.pid == os.getpid() and not store.closed:
+        return store
+
+    try:
+        shm = shared_memory.SharedMemory(name = name, track = False)
+    except TypeError:
+        # Python < 3.13 has no track argument
+        shm = shared_memory.SharedMemory(name = name)
+
+    return shared_store(shm, False)
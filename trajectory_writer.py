@@ -0,0 +1,188 @@
+#!/usr/bin/python
+
+# background encoding and writing of saved figures
+#
+# saving a figure has two parts: rendering it to pixels, which must happen
+# before the figure is changed or closed, and compressing the pixels to PNG
+# and writing the file, which is often the larger part at 300 dpi. when the
+# writer is enabled, the figure is rendered into an RGBA buffer in the
+# drawing thread and the buffer is handed to a small pool of writer
+# threads (PNG compression releases the GIL), so the next figure is drawn
+# while the previous one is written. at most queue buffers wait for a
+# writer; drawing blocks when the queue is full, which bounds the memory
+# held by buffers.
+#
+# errors of background writes don't stop drawing: they are collected and
+# returned by flush(), which trajectory_classes calls at the end of every
+# batch (and worker processes at the end of every job), e.g.
+#
+#   import trajectory_writer
+#   trajectory_writer.enable(threads = 2, compression = 1)
+#   tdir.plot_all_separate(save = True, workers = 1)
+#
+# compression is the PNG compression level (0-9, None for the default of
+# the PNG encoder); low levels write larger files much faster, e.g. for
+# draft runs. it also applies to figures saved directly while the writer is
+# disabled. the images written in the background are the same as those of
+# savefig.
+
+import numpy as np
+
+import os
+import io
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+enabled = False
+threads = 2               # writer threads
+queue = 8                 # rendered figures waiting for a writer, at most
+compression = None        # PNG compression level, or None for the default
+
+pool = None
+slots = None              # free places in the queue
+pending = []              # futures of the writes not yet flushed
+errors = []               # (path, error) of failed writes
+lock = threading.Lock()
+
+
+def enable(threads = 2, queue = 8, compression = None):
+    settings({'enabled': True, 'threads': threads, 'queue': queue,
+              'compression': compression})
+
+
+# wait for the pending writes, stop the writer threads and return the
+# errors (see flush)
+
+def disable():
+
+    failed = flush()
+
+    settings({'enabled': False, 'threads': threads, 'queue': queue,
+              'compression': compression})
+
+    return failed
+
+
+# settings as a dict (sent to worker processes) or set from one
+
+def settings(new = None):
+
+    global enabled, threads, queue, compression, pool, slots
+
+    if new is None:
+        return {'enabled': enabled, 'threads': threads, 'queue': queue,
+                'compression': compression}
+
+    # the pending writes finish first; their errors are kept for flush()
+
+    if pool is not None:
+        pool.shutdown()
+        pool = None
+
+    enabled = new['enabled']
+    threads = new['threads']
+    queue = new['queue']
+    compression = new['compression']
+
+    if enabled:
+        pool = ThreadPoolExecutor(max_workers = threads)
+        slots = threading.BoundedSemaphore(queue)
+
+
+# keyword arguments of savefig for the compression level
+
+def savefig_kwargs():
+
+    if compression is None:
+        return {}
+
+    return {'pil_kwargs': {'compress_level': compression}}
+
+
+# save figure fig to path at dpi: render it now, write it in the
+# background; with sink given, the encoded image is passed to sink(data)
+# instead of being written to path (see trajectory_archive)
+
+def submit(fig, path, dpi, sink = None):
+
+    # pixels exactly as savefig renders them for a PNG
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format = 'rgba', dpi = dpi)
+
+    w = int(fig.get_size_inches()[0] * dpi)
+    rgba = np.frombuffer(buf.getbuffer(), np.uint8).reshape(-1, w, 4)
+
+    slots.acquire()
+
+    try:
+        future = pool.submit(write, rgba, path, dpi, sink)
+    except BaseException:
+        slots.release()
+        raise
+
+    future.add_done_callback(lambda f: slots.release())
+
+    with lock:
+        pending[:] = [f for f in pending if not f.done()]
+        pending.append(future)
+
+
+def write(rgba, path, dpi, sink = None):
+
+    import matplotlib.image
+
+    try:
+        if sink is None:
+            matplotlib.image.imsave(path, rgba, format = 'png', dpi = dpi,
+                                    **savefig_kwargs())
+        else:
+            buf = io.BytesIO()
+            matplotlib.image.imsave(buf, rgba, format = 'png', dpi = dpi,
+                                    **savefig_kwargs())
+            sink(buf.getvalue())
+    except Exception:
+        with lock:
+            errors.append((path, traceback.format_exc()))
+
+
+# wait for all pending writes and return the errors since the last flush
+# as (path, error) tuples
+
+def flush():
+
+    with lock:
+        waiting = list(pending)
+        pending.clear()
+
+    for future in waiting:
+        future.result()
+
+    with lock:
+        failed = list(errors)
+        errors.clear()
+
+    return failed
+
+
+# a forked process (a batch worker) has none of the writer threads of its
+# parent: start with an empty queue and new threads
+
+def _after_fork():
+
+    global pool, slots, lock
+
+    pending.clear()
+    errors.clear()
+    lock = threading.Lock()
+
+    if enabled:
+        pool = ThreadPoolExecutor(max_workers = threads)
+        slots = threading.BoundedSemaphore(queue)
+    else:
+        pool = None
+
+
+os.register_at_fork(after_in_child = _after_fork)